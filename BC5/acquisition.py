@@ -0,0 +1,342 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from urllib.parse import urlparse
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Asynchronous upstream acquisition
+#
+# Every download from yahoo (chart API) and binance (ticker API) runs on one asyncio event loop in a background thread:
+#   - at most max_concurrency requests are in flight and every host has its own rate limit (a token bucket), so a
+#     refresh of every coin does not get the dashboard throttled
+#   - timeouts, connection errors, 429 and 5xx answers are retried with exponential backoff and full jitter, a 429
+#     waits at least for its Retry-After
+#   - cached() serves stale-while-revalidate: past its ttl a value (however old, e.g. seeded from the last snapshot) is
+#     still returned at once while a single background request refreshes it, only a key without any value makes the
+#     caller wait
+# The dash callbacks and the background threads call the blocking facade (bars, bars_many, prices, cached), which
+# submits the coroutines to the loop and waits for them: the requests of a refresh of every coin run max_concurrency at
+# a time instead of one after the other, so it takes a few times its slowest request rather than the sum of all.
+#
+# A forked process (the background callbacks of the DiskcacheManager) does not inherit the thread running the loop:
+# it starts its own loop, session and locks on first use and keeps the cached values.
+
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/"
+BINANCE_TICKER_URL = "https://api.binance.com/api/v3/ticker/price"
+# host -> (requests per second, burst). The yahoo burst covers a whole refresh of the leaderboards (20 coins on 3
+# frames) so it starts at once; the rate only slows down what follows, the bucket is full again well before the next
+# refresh
+RATE_LIMITS = {"query1.finance.yahoo.com": (5, 64), "api.binance.com": (10, 20)}
+# answers worth trying again
+RETRY_STATUS = {429, 500, 502, 503, 504}
+# yahoo refuses requests without a browser user agent
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+INTRADAY = ["15m", "60m"]
+
+
+class UpstreamError(Exception):
+    """a request that failed for good: after its retries, or with an answer not worth retrying (status)"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class RateLimiter:
+    """token bucket: rate requests per second on average, burst at once"""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def backoff(attempt, base=0.5, cap=20):
+    """seconds to wait before retry number attempt (from 0): anywhere in an exponentially growing window"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+def _retry_after(response):
+    try:
+        return float(response.headers.get("Retry-After", 0))
+    except ValueError:
+        return 0
+
+
+def yahoo_frame(result, interval):
+    """returns the bars of a yahoo chart result as yfinance does: Open, High, Low, Close, Adj Close and Volume indexed
+    by Date (by a timezone aware Datetime for intraday bars)"""
+    timestamps = result.get("timestamp") or []
+    indicators = result.get("indicators", {})
+    quote = indicators["quote"][0] if len(timestamps) > 0 else {}
+
+    def values(series, name):
+        # missing values come as null
+        return np.asarray(series.get(name) or [np.nan] * len(timestamps), dtype="float64")
+
+    close = values(quote, "close")
+    adjclose = indicators.get("adjclose")
+    index = pd.to_datetime(timestamps, unit="s", utc=True).tz_convert(result["meta"].get("exchangeTimezoneName", "UTC"))
+    data = pd.DataFrame({"Open": values(quote, "open"), "High": values(quote, "high"), "Low": values(quote, "low"),
+                         "Close": close, "Adj Close": values(adjclose[0], "adjclose") if adjclose else close,
+                         "Volume": values(quote, "volume")}, index=index)
+    if interval in INTRADAY:
+        data.index.name = "Datetime"
+    else:
+        data.index = data.index.tz_localize(None).normalize().rename("Date")
+    # the bar still running can be sent twice
+    return data[~data.index.duplicated(keep="last")]
+
+
+# the acquisition layers of this process, reset in a forked child
+_instances = weakref.WeakSet()
+
+
+def _after_fork():
+    for acquisition in list(_instances):
+        acquisition._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class Acquisition:
+    """yahoo bars and binance prices downloaded on an asyncio event loop, behind a blocking facade"""
+
+    def __init__(self, max_concurrency=16, retries=3, timeout=20, rate_limits=None, yahoo_url=YAHOO_CHART_URL,
+                 binance_url=BINANCE_TICKER_URL):
+        self.max_concurrency = max_concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.rate_limits = RATE_LIMITS if rate_limits is None else rate_limits
+        self.yahoo_url = yahoo_url
+        self.binance_url = binance_url
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._limiters = {}
+        # cached(): key -> (value, time it was fetched) and key -> running refresh
+        self._values = {}
+        self._refreshing = {}
+        self._lock = threading.Lock()
+        _instances.add(self)
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Event loop and requests
+
+    def _start(self):
+        """returns the event loop, started in its thread on first use"""
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="acquisition", daemon=True).start()
+            return self._loop
+
+    def _after_fork(self):
+        """forgets the loop of the parent process (its thread is not running here) and what was bound to it"""
+        # kept, not collected: closing the session here would warn about and touch the sockets of the parent
+        self._parent = (self._loop, self._session)
+        self._loop = None
+        self._session = None
+        self._semaphore = None
+        self._limiters = {}
+        self._refreshing = {}
+        # it may have been held by another thread of the parent when it forked
+        self._lock = threading.Lock()
+
+    def run(self, coroutine, timeout=None):
+        """runs coroutine on the event loop and waits for its result, must not be called from the loop itself"""
+        return asyncio.run_coroutine_threadsafe(coroutine, self._start()).result(timeout)
+
+    def close(self):
+        """closes the http session and stops the event loop"""
+        with self._lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._session is not None:
+            asyncio.run_coroutine_threadsafe(self._session.close(), loop).result()
+            self._session = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    async def _session_open(self):
+        if self._session is None:
+            import aiohttp
+
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  headers={"User-Agent": USER_AGENT},
+                                                  connector=aiohttp.TCPConnector(limit=self.max_concurrency,
+                                                                                 ttl_dns_cache=300))
+        return self._session
+
+    def _limiter(self, host):
+        if host not in self._limiters:
+            limit = self.rate_limits.get(host)
+            self._limiters[host] = None if limit is None else RateLimiter(*limit)
+        return self._limiters[host]
+
+    async def request(self, url, params=None):
+        """GETs url and returns the decoded JSON answer, retrying timeouts, connection errors, 429 and 5xx"""
+        import aiohttp
+
+        session = await self._session_open()
+        host = urlparse(url).hostname
+        limiter = self._limiter(host)
+        for attempt in range(self.retries + 1):
+            wait = 0
+            start = time.perf_counter()
+            try:
+                if limiter is not None:
+                    await limiter.acquire()
+                async with self._semaphore:
+                    # the latency of the request itself, without the wait for the rate limit and a free slot
+                    start = time.perf_counter()
+                    async with session.get(url, params=params) as response:
+                        if response.status < 400:
+                            answer = await response.json(content_type=None)
+                            metrics.observe_upstream(host, response.status, time.perf_counter() - start)
+                            return answer
+                        metrics.observe_upstream(host, response.status, time.perf_counter() - start)
+                        error = UpstreamError(f"{host} answered {response.status}", response.status)
+                        if response.status not in RETRY_STATUS:
+                            raise error
+                        wait = _retry_after(response)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as exception:
+                metrics.observe_upstream(host, exception.__class__.__name__, time.perf_counter() - start)
+                error = UpstreamError(f"{host} failed ({exception.__class__.__name__}: {exception})")
+            if attempt == self.retries:
+                raise error
+            metrics.upstream_retry(host)
+            await asyncio.sleep(max(backoff(attempt), wait))
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Yahoo and binance
+
+    async def fetch_bars(self, coin, interval, period=None, start=None):
+        """returns the yahoo bars of the coin over period (e.g. 1y, max), or since start when it is given"""
+        params = {"interval": interval, "includePrePost": "false", "events": "div,splits"}
+        if start is None:
+            params["range"] = period or "max"
+        else:
+            params["period1"] = int(pd.Timestamp(start).timestamp())
+            params["period2"] = int(time.time())
+        answer = await self.request(self.yahoo_url + coin, params)
+        chart = answer.get("chart") or {}
+        if chart.get("error") or not chart.get("result"):
+            raise UpstreamError(f"yahoo has no {interval} bars of {coin} ({chart.get('error')})")
+        return yahoo_frame(chart["result"][0], interval)
+
+    async def fetch_prices(self, symbols):
+        """returns the binance prices of symbols ({binance symbol: name}) as a Price frame indexed by name"""
+        try:
+            tickers = await self.request(self.binance_url, {"symbols": json.dumps(list(symbols), separators=(",", ":"))})
+        except UpstreamError as error:
+            if error.status != 400:
+                raise
+            # one unknown symbol makes binance reject the whole batch, they are asked for one by one instead
+            answers = await asyncio.gather(*[self.request(self.binance_url, {"symbol": symbol}) for symbol in symbols],
+                                           return_exceptions=True)
+            tickers = []
+            for symbol, answer in zip(symbols, answers):
+                if isinstance(answer, Exception):
+                    print(f"acquisition: no binance price for {symbol} ({answer})")
+                else:
+                    tickers.append(answer)
+        return pd.DataFrame({"Price": np.round([float(ticker["price"]) for ticker in tickers], 3)},
+                            index=[symbols[ticker["symbol"]] for ticker in tickers])
+
+    # ------------------------------------------------------------------------------------------------------------------
+    # Blocking facade
+
+    def bars(self, coin, interval, period=None, start=None):
+        """returns the bars of one coin (see fetch_bars)"""
+        return self.run(self.fetch_bars(coin, interval, period, start))
+
+    def bars_many(self, requests):
+        """returns the bars of every (coin, interval, period, start) request, all downloaded at once; None for the
+        requests that failed"""
+        async def gather():
+            return await asyncio.gather(*[self.fetch_bars(*request) for request in requests], return_exceptions=True)
+
+        results = self.run(gather())
+        for request, result in zip(requests, results):
+            if isinstance(result, Exception):
+                print(f"acquisition: {request[0]} {request[1]} bars not downloaded ({result})")
+        return [None if isinstance(result, Exception) else result for result in results]
+
+    def prices(self, symbols):
+        """returns the binance prices of symbols (see fetch_prices)"""
+        return self.run(self.fetch_prices(symbols))
+
+    def seed(self, key, value, fetched):
+        """gives cached() a value of key fetched at unix time fetched, unless it already has a newer one"""
+        with self._lock:
+            if key not in self._values or self._values[key][1] < fetched:
+                self._values[key] = (value, fetched)
+
+    def peek(self, key):
+        """returns the last value of key without downloading anything, None if there is none"""
+        with self._lock:
+            cached = self._values.get(key)
+        return None if cached is None else cached[0]
+
+    def cached(self, key, ttl, load):
+        """returns the value of load() (a coroutine function) for key (a tuple, counted in the cache metrics under its
+        first item), stale-while-revalidate
+
+        a value younger than ttl seconds is returned as it is, an older one too while one background download
+        refreshes it. Only a key without any value waits for the download."""
+        with self._lock:
+            cached = self._values.get(key)
+        if cached is not None and time.time() - cached[1] < ttl:
+            metrics.cache_result(key[0], "hit")
+            return cached[0]
+        refresh = self._refresh(key, load)
+        if cached is not None:
+            metrics.cache_result(key[0], "stale")
+            return cached[0]
+        metrics.cache_result(key[0], "miss")
+        return refresh.result()
+
+    def _refresh(self, key, load):
+        """starts the download of key unless one is running, returns its (concurrent.futures) future"""
+        loop = self._start()
+        with self._lock:
+            refresh = self._refreshing.get(key)
+            if refresh is None or refresh.done():
+                refresh = self._refreshing[key] = asyncio.run_coroutine_threadsafe(self._store(key, load), loop)
+        return refresh
+
+    async def _store(self, key, load):
+        try:
+            value = await load()
+        except UpstreamError as error:
+            print(f"acquisition: {key} not refreshed ({error})")
+            raise
+        with self._lock:
+            self._values[key] = (value, time.time())
+        return value
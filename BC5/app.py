@@ -1,30 +1,49 @@
 import numpy as np
 import pandas as pd
-import yfinance as yf
 from datetime import datetime
-from dateutil.relativedelta import relativedelta
 import plotly.graph_objs as go
 import dash_bootstrap_components as dbc
 import dash
-from dash import dcc, Dash, html
-from dash.dependencies import Input, Output
+from dash import dcc, Dash, html, DiskcacheManager
+from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 import base64
-from plotly.subplots import make_subplots
-import json
-import requests
+import os
+import threading
+import diskcache
 import warnings
-from math import ceil
-from datetime import timedelta
-from sklearn.preprocessing import MinMaxScaler
-import tensorflow as tf
-# from tensorflow.keras.models import Sequential
-# from tensorflow.keras.layers import Dense, Dropout, LSTM
-import datetime as dt
+# aiohttp, scikit-learn and tensorflow are imported where they are first used (acquisition.py, forecast.py), so a
+# worker does not pay for them before serving its first page
+from acquisition import Acquisition
+from data_provider import MarketData
+from figure_cache import FigureCache
+from figure_encoding import compact_figure
+from charts import data_version, ta_parameters, technical_analysis, zoom_range
+from indicators import IndicatorEngine
+import metrics
+from metrics import Stopwatch
+from profiling import Profiler
+from ohlcv_store import OHLCVStore
+from price_feed import PriceFeed
+from scheduler import PredictionScheduler
+from stream import BINANCE_STREAM_URL, LiveStream, epoch_ms, extend_figures
+from warmup import WarmUp
 warnings.filterwarnings("ignore")
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Calling the app
-app = Dash(external_stylesheets=[dbc.themes.GRID])
+# background callbacks (the predictions) run from a local disk queue
+background_cache = diskcache.Cache("cache/background")
+app = Dash(external_stylesheets=[dbc.themes.GRID], background_callback_manager=DiskcacheManager(background_cache))
+# prometheus metrics on /metrics: per stage timings, cache hits and misses, upstream latencies (metrics.py);
+# SLOW_CALLBACK_MS logs the callbacks slower than that with their inputs
+metrics.instrument(app.server, slow_ms=float(os.environ["SLOW_CALLBACK_MS"]) if "SLOW_CALLBACK_MS" in os.environ else None)
+# the background callbacks run in forked processes, their measures come back through a disk queue
+metrics.forward_forked("cache/metrics")
+# PROFILE_FRACTION of the callbacks run under the profiler, the last PROFILE_KEEP profiles are downloaded from
+# /admin/profiles (profiling.py), which also changes the fraction at runtime; PROFILE_TOKEN protects the admin routes
+profiler = Profiler(fraction=float(os.environ.get("PROFILE_FRACTION", 0)), keep=int(os.environ.get("PROFILE_KEEP", 20)))
+profiler.instrument(app.server, token=os.environ.get("PROFILE_TOKEN"))
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Building the necessary elements / functions
@@ -75,27 +94,47 @@ dropdown_tech_analysis_indicator = dcc.Dropdown(
     style={"box-shadow" : "1px 1px 3px lightgray", "background-color" : "white"}
     )
 
-#downloading all data that will be needed for the leaderboard
-data_lb_1d = yf.download(tickers=coins, period = "1d", interval = "15m")
-data_lb_5d = yf.download(tickers=coins, period = "5d", interval = "60m")
-data_lb_1y = yf.download(tickers=coins, period = "1y", interval = "1d")
-data_lb_1mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=1)].set_index("Date")
-data_lb_2mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=2)].set_index("Date")
-data_lb_3mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=3)].set_index("Date")
-
-#donwloading coin price 
-leaderboard_prices = pd.DataFrame(columns = ["Price"])
-for coin in coins:
-    if coin == "LUNA1-USD":
-        coin = "LUNA-USD"
-    key = "https://api.binance.com/api/v3/ticker/price?symbol="
-    coin_key = coin.replace("-", "")
-    coin_key = coin_key + "T"
-    url = key + coin_key
-    data = requests.get(url)
-    data = data.json()
-    rounded = np.round(float(data["price"]), 3)
-    leaderboard_prices.loc[coin] = rounded
+# leaderboard data and prices: served from the last local snapshot while fresh data is downloaded in the background
+# OFFLINE=1 serves the store and the snapshot as they are, without yahoo or binance (benchmarks/callbacks.py)
+offline = os.environ.get("OFFLINE", "0") == "1"
+# every yahoo and binance request goes through one event loop, with bounded concurrency, rate limits and retries
+upstream = Acquisition(max_concurrency=int(os.environ.get("UPSTREAM_CONCURRENCY", 16)))
+price_feed = PriceFeed(coins, ttl=30, offline=offline, upstream=upstream)
+market_data = MarketData(coins, price_feed, OHLCVStore(directory="store"), directory="snapshot", offline=offline,
+                         upstream=upstream)
+
+# live prices and bars of the technical analysis intervals from the binance websocket (stream.py), pushed to the open
+# dashboards every STREAM_SECONDS; STREAM_URL=ws://localhost:8765/stream reads replay_server.py instead, STREAM=0 (or
+# OFFLINE=1) turns it off
+streaming = os.environ.get("STREAM", "1") == "1" and not offline
+live_stream = LiveStream(coins, intervals=sorted({ta_parameters(range)[0] for range in dropdown_tech_analysis_range.options}),
+                         url=os.environ.get("STREAM_URL", BINANCE_STREAM_URL))
+
+# predictions of every coin, computed in background worker processes
+# FORECASTER=lstm brings back the tensorflow model, the default ridge regression trains in milliseconds
+# one model for all coins unless FORECAST_BATCHED=0, which trains one model per coin
+prediction_scheduler = PredictionScheduler(coins, lambda: market_data.frame("1y"), max_workers=2,
+                                           results=diskcache.Cache("cache/predictions"),
+                                           backend=os.environ.get("FORECASTER", "ridge"),
+                                           batched=os.environ.get("FORECAST_BATCHED", "1") == "1")
+market_data.subscribe(prediction_scheduler.refresh)
+
+# serialized technical analysis figures per (coin, range, indicator) and version of the bars, filled ahead of the
+# requests for every dropdown combination by the warm-up and by the callback on a miss; WARMUP=0 turns the warm-up off
+figure_cache = FigureCache(max_bytes=int(os.environ.get("FIGURE_CACHE_MB", 256)) * 2 ** 20)
+warm_up = WarmUp(coins, dropdown_tech_analysis_range.options, dropdown_tech_analysis_indicator.options,
+                 market_data.history, figure_cache, io_workers=8,
+                 cpu_workers=int(os.environ.get("WARMUP_WORKERS", os.cpu_count())))
+
+# the worker processes re-import this file as __mp_main__, they must not start their own scheduler
+if __name__ != "__mp_main__":
+    market_data.start()
+    prediction_scheduler.start()
+    if streaming:
+        live_stream.start()
+    if os.environ.get("WARMUP", "1") == "1":
+        warm_up.start()
+        market_data.subscribe(warm_up.start)
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -104,38 +143,65 @@ for coin in coins:
 image_filename = 'crypto.png' # replace with your own image
 encoded_image = base64.b64encode(open(image_filename, 'rb').read())
 
+# rolling state of the technical indicators of the coins that were shown
+indicator_engine = IndicatorEngine(max_series=64)
+
+# percentage changes per range, valid as long as the market data snapshot does not change; the callbacks run in
+# several threads
+leaderboard_cache = {}
+leaderboard_lock = threading.Lock()
+
+def percentage_changes(close):
+    """returns the percentage change of every column of close between its first and last valid value"""
+    values = close.to_numpy(dtype="float64")
+    valid = ~np.isnan(values)
+    # first and last valid row of each column, so coins listed during the range are compared from their listing
+    first = valid.argmax(axis=0)
+    last = len(values) - 1 - valid[::-1].argmax(axis=0)
+    columns = np.arange(values.shape[1])
+    prc = (values[last, columns] - values[first, columns]) / values[last, columns] * 100
+    prc[~valid.any(axis=0)] = np.nan
+    return pd.Series(np.round(prc, 2), index=close.columns, name="Percentage")
+
+def current_prices():
+    """returns the prices of the last snapshot with the ones the live stream received since on top"""
+    return live_stream.latest(market_data.prices)
+
+@metrics.timed
 def create_leaderboard(lb_range = "1d"):
     """creates a leaderboard of the most performing coins in a time range 
     possible values for argument: one day 1d, five days 5d, one month 1mo, 2months 2mo, one quarter 3mo, one year 1y"""
 
-    if (lb_range == "1d"):
-        data_lb = data_lb_1d
-    elif (lb_range == "5d"):
-        data_lb = data_lb_5d
-    elif (lb_range == "1mo"):
-        data_lb = data_lb_1mo
-    elif (lb_range == "2mo"):
-        data_lb = data_lb_2mo
-    elif (lb_range == "3mo"):
-        data_lb = data_lb_3mo
+    stopwatch = Stopwatch("create_leaderboard")
+    if lb_range not in ["1d", "5d", "1mo", "2mo", "3mo"]:
+        lb_range = "1y"
+    data_lb = market_data.frame(lb_range)
+    stopwatch.lap("frame")
+    leaderboard_prices = current_prices()
+    stopwatch.lap("prices")
+
+    key = (lb_range, market_data.version, datetime.now().date())
+    with leaderboard_lock:
+        changes = leaderboard_cache.get(key)
+    if changes is None:
+        metrics.cache_result("leaderboard", "miss")
+        changes = percentage_changes(data_lb["Close"][coins])
+        with leaderboard_lock:
+            if any(cached[1] != key[1] for cached in leaderboard_cache):
+                leaderboard_cache.clear()
+            leaderboard_cache[key] = changes
     else:
-        data_lb = data_lb_1y
-
-    # creating empty df
-    leaderboard_prc = pd.DataFrame(columns = ["Percentage"])
-    # appending percentage change in the timeframe for each coin into leaderboard df
-    for coin in coins:
-        prc = ((data_lb["Close", coin].iloc[-1] - data_lb["Close", coin].iloc[0]) / data_lb["Close", coin].iloc[-1]) * 100
-        prc = np.round(prc, 2)
-        leaderboard_prc.loc[coin] = prc
+        metrics.cache_result("leaderboard", "hit")
+    stopwatch.lap("percentages")
 
-    leaderboard = leaderboard_prc.merge(right=leaderboard_prices, how="inner", on=leaderboard_prc.index).set_index("key_0")
+    leaderboard = changes.to_frame().join(leaderboard_prices, how="inner")
     leaderboard.sort_values("Percentage", ascending=False, inplace=True)
+    stopwatch.lap("join")
     return data_lb, leaderboard
 
 def get_linegraph(close_price, coin_name):
 
-    if close_price[0] > close_price[-1]:
+    if close_price.iloc[0] > close_price.iloc[-1]:
         fig = go.Scatter(
             x = close_price.index,
             y = close_price.values,
@@ -183,7 +249,8 @@ def plot_leaderboard(leaderboard):
     return fig
 
 
-def plot_technical_analyis(coin='BTC-USD', range="max", indicator = "EMA"):
+@metrics.timed
+def plot_technical_analyis(coin='BTC-USD', range="max", indicator = "EMA", x_range = None):
     """returning technical analysis plots for a certain coin over the time of existence of the coin"""
 
     '''
@@ -196,269 +263,76 @@ def plot_technical_analyis(coin='BTC-USD', range="max", indicator = "EMA"):
     # display_table - (bool)whether to display the date and price table at buy/sell positions(True/False)
     
     
-    short_window = 20
-    long_window = 50
-
-
-    if (range in ["1d", "5d"]):
-        df = yf.download(tickers=coin, period = range, interval = "15m")
-        df.reset_index(inplace = True)
-        short_window = 9
-        long_window = 21
-        boll_window = 18
-        x_axis = df["Datetime"]
-    if (range in ["1mo", "3mo", "1y", "max"]):
-        df = yf.download(tickers=coin, period = range, interval = "1d")
-        short_window = 100
-        long_window = 200
-        boll_window = 30
-        x_axis = df.index
-
-
-
-    # column names for long and short moving average columns
-    short_window_col = str(short_window) + '_' + indicator
-    long_window_col = str(long_window) + '_' + indicator 
-
-    df['sma'] = df['Close'].rolling(boll_window).mean()
-    df['std'] = df['Close'].rolling(boll_window).std(ddof = 0)
-    
-    if indicator == 'SMA':
-        # Create a short simple moving average column
-        df[short_window_col] = df['Close'].rolling(window = short_window, min_periods = 1).mean()
-
-        # Create a long simple moving average column
-        df[long_window_col] = df['Close'].rolling(window = long_window, min_periods = 1).mean()
-
-    elif indicator == 'EMA':
-        # Create short exponential moving average column
-        df[short_window_col] = df['Close'].ewm(span = short_window, adjust = False).mean()
-
-        # Create a long exponential moving average column
-        df[long_window_col] = df['Close'].ewm(span = long_window, adjust = False).mean()
-
-    # create a new column 'Signal' such that if faster moving average is greater than slower moving average 
-    # then set Signal as 1 else 0.
-    df['Signal'] = 0.0  
-    df['Signal'] = np.where(df[short_window_col] > df[long_window_col], 1.0, 0.0) 
-
-    # create a new column 'Position' which is a day-to-day difference of the 'Signal' column. 
-    df['Position'] = df['Signal'].diff() 
-    
-    layout = go.Layout(
-        autosize=False,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-    
-        xaxis= go.layout.XAxis(linecolor = 'black',
-                              linewidth = 1,
-                              mirror = True),
-    
-        yaxis= go.layout.YAxis(linecolor = 'black',
-                              linewidth = 1,
-                              mirror = True),
-    
-        margin=go.layout.Margin(
-            l=50,
-            r=50,
-            b=100,
-            t=100,
-            pad = 4
-        )
-    )
-    
-    fig1 = go.Figure(
-    
-        data=[go.Candlestick(
-        x=x_axis,
-        open=df['Open'], high=df['High'],
-        low=df['Low'], close=df['Close'],
-        increasing_line_color= 'Green', decreasing_line_color= 'Red'
-    ), #
-                go.Scatter(
-                    x = x_axis, 
-                    y = df[short_window_col],
-                    mode = 'lines', 
-                    name = short_window_col,
-                    line = {'color': '#00ff11'}
-                ),
-                go.Scatter(
-                    x = x_axis, 
-                    y = df[long_window_col],
-                    mode = 'lines',
-                    name = long_window_col,
-                    line = {'color': '#ff0008'}
-                ),
-                go.Scatter(
-                    x = x_axis[df["Position"] == -1], 
-                    y = df[long_window_col][df["Position"] == -1],
-                    mode = 'markers',
-                    marker= dict(symbol='triangle-down', size = 14),
-                    name = 'Sell',
-                    line = {'color': '#ff0000'}
-                ),
-                go.Scatter(
-                    x = x_axis[df["Position"] == 1], 
-                    y = df[short_window_col][df["Position"] == 1],
-                    mode = 'markers',
-                    marker= dict(symbol='triangle-up', size = 14),
-                    name = 'Buy',
-                    line = {'color': '#00ff95'}
-                ), 
-                 go.Scatter(
-                    x = x_axis, 
-                    y = df["sma"] + (df['std'] * 2),
-                    line_color = 'gray',
-                    line = {'dash': 'dash'},
-                    name = 'upper band',
-                    opacity = 0.3
-                ),
-                go.Scatter(
-                    x = x_axis, 
-                    y = df["sma"] - (df['std'] * 2),
-                    line_color = 'gray',
-                    line = {'dash': 'dash'},
-                    fill = 'tonexty',
-                    name = 'lower band',
-                    opacity = 0.3
-                ),
-            ]
-        ,layout=layout)
-
-    fig2 = go.Figure(
-                data = go.Bar(
-                    x = x_axis,
-                    y = df["Volume"],
-                    marker_color = "#85acc9"
-                )
-    )
-
-    fig2.update_layout(
-        title = f'The Barchart graph showing volume for {coin}',
-        xaxis_title = 'Date',
-        yaxis_title = 'Amount of asset traded during the day',
-        xaxis_rangeslider_visible = False,
-        autosize=False,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)'
-    )
-
-    fig1.update_layout(
-        legend=dict(yanchor="top", y=0.9, xanchor="left", x=0.06),
-        title = f'The Candlestick graph for {coin}',
-        xaxis_title = 'Date',
-        yaxis_title = coin,
-        xaxis_rangeslider_visible = False #DEFAULT TRUE, WHILE TAKING SCREENSHOT WE PUT IT TO FALSE
-    )
-
+    stopwatch = Stopwatch("plot_technical_analyis")
+    interval, short_window, long_window, boll_window = ta_parameters(range)
+    df = market_data.history(coin, period = range, interval = interval)
+    stopwatch.lap("history")
+
+    # a zoomed view (x_range) is built from the visible bars only and not cached
+    if x_range is not None:
+        return technical_analysis(coin, range, indicator, df, indicator_engine, x_range=x_range)
+
+    # figures built by the warm-up (or an earlier request) from the same bars are served as they are
+    version = data_version(df)
+    cached = figure_cache.get((coin, range, indicator), version)
+    stopwatch.lap("cache")
+    if cached is not None:
+        return cached[0], cached[1]
+
+    fig1, fig2 = technical_analysis(coin, range, indicator, df, indicator_engine)
+    stopwatch.lap("build")
+    figure_cache.put((coin, range, indicator), version, [fig1, fig2])
+    # the figures are serialized into the cache
+    stopwatch.lap("serialize")
     return fig1, fig2
 
+def stream_cursor(coin, range, indicator, fig1, fig2):
+    """returns what the live updates need to know about the technical analysis figures sent to the browser: the
+    stream of their bars, the open time of their last bar (ms), the live traces (the last ones) and the bars already
+    appended to them"""
+    interval = ta_parameters(range)[0]
+    df = market_data.history(coin, period = range, interval = interval)
+    return {"coin": coin, "range": range, "indicator": indicator, "interval": interval, "seq": 0,
+            "since": epoch_ms(df.index[-1]) if len(df) > 0 else 0, "times": [],
+            "candles": len(fig1["data"]) - 1, "volume": len(fig2["data"]) - 1, "price": None}
+
 def plot_info_coin(coin = 'BTC-USD'):
     #changes code for binance API
     if coin == "LUNA1-USD":
         coin = "LUNA-USD"
-    rounded = leaderboard_prices.loc[coin][0].astype("str")
+    rounded = current_prices().loc[coin].iloc[0].astype("str")
     string = "Today's price for " + coin + " is " + rounded
     return string, rounded
 
 
+@metrics.timed
 def prediction(coin='BTC-USD'):
-    #end = dt.date.today()
-    #start = end - dt.timedelta(days=365)
-    #df = yf.download(tickers=coin, start=start,end=end, interval="1d")
-    #df = pd.DataFrame(df['Close'])
-
-    df = pd.DataFrame(data_lb_1y["Close", coin])
-    df = df["Close"].tail(100)
-
-    tf.random.set_seed(12)
-
-    # scaling for better LSTM performance
-    scaler = MinMaxScaler()
-    scaled = scaler.fit_transform(df.values.reshape(-1, 1))
-
-    # how many days to use for testing
-    testing_days = ceil(len(scaled) * 0.2)
-    # how many days to go back for predicting one value
-    prediction_days = ceil(ceil(len(scaled) * 0.8) * 0.05)
-    # how many days in the future to predict from the day after the last date (zero means it predicts the day after)
-    future_day = 1
-
-    X, y = [], []
-
-    # appending target and input data to be later split
-    for i in range(prediction_days, len(scaled) - future_day):
-        X.append(scaled[i - prediction_days:i, 0])
-        y.append(scaled[i + future_day, 0])
-
-    X_train = X[:-testing_days]
-    y_train = y[:-testing_days]
-
-    X_train, y_train = np.array(X_train), np.array(y_train)
-    X_train = np.reshape(X_train, (X_train.shape[0], X_train.shape[1], 1))
-
-    # Building and training the model
-    model = tf.keras.models.Sequential()
-    model.add(tf.keras.layers.LSTM(units=50, return_sequences=True, input_shape=(X_train.shape[1], 1)))
-    # Prevent overfitting
-    model.add(tf.keras.layers.Dropout(0.2))
-
-    model.add(tf.keras.layers.LSTM(units=50, return_sequences=True))
-
-    model.add(tf.keras.layers.Dropout(0.2))
-
-    model.add(tf.keras.layers.LSTM(units=50))
-
-    model.add(tf.keras.layers.Dropout(0.2))
-
-    model.add(tf.keras.layers.Dense(units=1))
-
-    model.compile(optimizer='adam', loss='mse')
-    model.fit(X_train, y_train, epochs=1)
-
-    model_inputs = scaled[len(scaled) - prediction_days - testing_days:]
-
-    # building test data with same logic as train data, but for last records
-    X_test = []
-    for i in range(prediction_days, len(model_inputs)):
-        X_test.append(model_inputs[i - prediction_days:i, 0])
-
-    X_test = np.array(X_test)
-    X_test = np.reshape(X_test, (X_test.shape[0], X_test.shape[1], 1))
-
-    predicted_prices_sc = model.predict(X_test)
-    # again prices in dollars
-    predicted_prices = scaler.inverse_transform(predicted_prices_sc.reshape(-1, 1))
-
-    df["Predicted Price"] = np.NaN
-
-    # add next day
-    df.reset_index(inplace=True)
-    df["Date"] = pd.to_datetime(df['Date'])
-    # last date in which we'll predict the  price
-    prediction_date = df.iloc[len(df) - 1]["Date"] + timedelta(days=future_day)
-    # adding the dates in the "future" to the df
-    for date in pd.date_range(start=df.iloc[len(df) - 1]["Date"], end=prediction_date):
-        df = df.append({'Date': date + timedelta(days=future_day)}, ignore_index=True)
-
-    # appending predicted prices
-    df.loc[df.index[-testing_days:], 'Predicted Price'] = predicted_prices
-    price_tmr = df["Predicted Price"].iloc[-2]
-    price_tmr = np.round(price_tmr, 4)
-
-    price_tmr2 = df["Predicted Price"].iloc[-1]
-    price_tmr2 = np.round(price_tmr2, 4)
-
-    return price_tmr, price_tmr2
+    """returns the precomputed predictions of the coin (see scheduler.py), None if they are not available"""
+    return prediction_scheduler.get(coin, timeout=120)
 
 def get_predictions(coin = 'BTC-USD'):
-    price_tmr, price_tmr2 = prediction(coin = coin)
-    price_tmr = price_tmr.astype("str")
-    price_tmr2 = price_tmr2.astype("str")
+    result = prediction(coin = coin)
+    if result is None:
+        pred_tomorrow = "The prediction for " + coin + " is not available yet"
+        return pred_tomorrow, "", None, None
+    price_tmr = result["price_tmr"].astype("str")
+    price_tmr2 = result["price_tmr2"].astype("str")
     pred_tomorrow = "The prediction for tomorrow is that " + coin + "'s price is " + price_tmr
     pred_tomorrow2 = "The prediction for the day after tomorrow is that " + coin + "'s price is " + price_tmr2
+    if result["stale_since"] is not None:
+        stale = " (stale since " + result["stale_since"].strftime("%d/%m %H:%M") + ", refresh running)"
+        pred_tomorrow += stale
+        pred_tomorrow2 += stale
     return pred_tomorrow, pred_tomorrow2, price_tmr, price_tmr2
 
+def gauge_hand(predicted_value, current_value, interval=0.05):
+    """returns the (x, y) end of the gauge needle pointing at current_value on a scale of predicted_value +- interval"""
+    min_value = predicted_value * (1 - interval)
+    max_value = predicted_value * (1 + interval)
+    hand_length = np.sqrt(2) / 4
+    hand_angle = np.pi * (1 - (max(min_value, min(max_value, current_value)) - min_value) / (max_value - min_value))
+    return 0.5 + hand_length * np.cos(hand_angle), 0.5 + hand_length * np.sin(hand_angle)
+
 def gauge_plot(predicted_value, current_value, interval=0.05, coin = 'BTC-USD'):
 
     predicted_value = predicted_value.astype("float")
@@ -468,10 +342,7 @@ def gauge_plot(predicted_value, current_value, interval=0.05, coin = 'BTC-USD'):
     quadrant_text = ["", "<b>Sell</b>", "<b>Hold</b>", "<b>Buy</b>"]
     n_quadrants = len(quadrant_colors) - 1
 
-    min_value = predicted_value * (1 - interval)
-    max_value = predicted_value * (1 + interval)
-    hand_length = np.sqrt(2) / 4
-    hand_angle = np.pi * (1 - (max(min_value, min(max_value, current_value)) - min_value) / (max_value - min_value))
+    hand_x, hand_y = gauge_hand(predicted_value, current_value, interval)
 
     fig = go.Figure(
         data=[
@@ -509,8 +380,8 @@ def gauge_plot(predicted_value, current_value, interval=0.05, coin = 'BTC-USD'):
                 ),
                 go.layout.Shape(
                     type="line",
-                    x0=0.5, x1=0.5 + hand_length * np.cos(hand_angle),
-                    y0=0.5, y1=0.5 + hand_length * np.sin(hand_angle),
+                    x0=0.5, x1=hand_x,
+                    y0=0.5, y1=hand_y,
                     line=dict(color="#333", width=4)
                 )
             ]
@@ -584,6 +455,11 @@ app.layout = dbc.Container([
             width=4,
             style={'padding':'2px 15px 15px 15px'})
     ], style={'padding':'2px 15px 15px 15px'}),
+
+    # live updates: the figures shown and the prediction of the gauge, polled for the bars and prices streamed since
+    dcc.Store(id="stream_cursor"),
+    dcc.Store(id="gauge_state"),
+    dcc.Interval(id="stream_interval", interval=int(os.environ.get("STREAM_SECONDS", 2)) * 1000, disabled=not streaming),
 ],
 #Container
 fluid=True,
@@ -603,7 +479,15 @@ style={'background-color':'#dae9f5',
     [Input('leaderboard_drop', 'value')])
 
 def plot(range):
+    from plotly.subplots import make_subplots
+
+    stopwatch = Stopwatch("leaderboard_callback")
+    # first run of the dashboard without a snapshot on disk
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
+    stopwatch.lap("wait")
     data_lb, leaderboard = create_leaderboard(range)
+    stopwatch.lap("create_leaderboard")
     top1, coin1, top2, coin2, bot1, coin3, bot2, coin4 = get_top_bot(data_lb, leaderboard)
     plt_coins = make_subplots(rows = 2, cols = 2, subplot_titles=(coin1, coin2, coin3, coin4))
     plt_coins.add_trace(top1, row = 1, col = 1)
@@ -623,30 +507,122 @@ def plot(range):
         plot_bgcolor='rgba(0,0,0,0)'
     )
     plt_coins.update_yaxes(tickprefix='$')
+    stopwatch.lap("figure")
     
+    # the four line charts go as typed arrays (figure_encoding.py)
+    plt_coins = compact_figure(plt_coins)
+    stopwatch.lap("encode")
     return plt_lb, plt_coins
 
-# 2nd callback -> builds technical analysis graph
+# 2nd callback -> builds technical analysis graph, only depends on the indicator math so it is not held back by the
+# predictions. The graphs are downsampled, zooming in on the candlestick chart reloads the visible range in detail
 @app.callback(
     [Output(component_id='technical_analysis', component_property='figure'),
     Output(component_id='technical_analysis_vol', component_property='figure'),
-    Output(component_id='table_info_coin', component_property='children'),
-    Output(component_id='prediction_tomorrow', component_property='children'),
-    Output(component_id='prediction_tomorrow2', component_property='children'),
-    Output(component_id='buy_sell', component_property='figure')],
+    Output(component_id='stream_cursor', component_property='data')],
     [Input('tech_analysis_coin_drop', 'value'),
     Input('tech_analysis_range_drop', 'value'),
-    Input('tech_analysis_indicator_drop', 'value')])
+    Input('tech_analysis_indicator_drop', 'value'),
+    Input('technical_analysis', 'relayoutData')])
 
-def plot(coin, range, indicator):
+def plot(coin, range, indicator, relayout):
     # first run of the dashboard
     if coin not in coins:
         coin = "BTC-USD"
-    ta, ta_vol = plot_technical_analyis(coin, range, indicator)
+    x_range = None
+    if dash.callback_context.triggered_id == 'technical_analysis':
+        x_range = zoom_range(relayout)
+        # pan mode, autosize and the other layout events keep the figure as it is
+        if x_range is False:
+            raise PreventUpdate
+    stopwatch = Stopwatch("technical_analysis_callback")
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
+    stopwatch.lap("wait")
+    ta, ta_vol = plot_technical_analyis(coin, range, indicator, x_range)
+    stopwatch.lap("plot_technical_analyis")
+    cursor = stream_cursor(coin, range, indicator, ta, ta_vol)
+    stopwatch.lap("cursor")
+    return ta, ta_vol, cursor
+
+# 3rd callback -> today's price of the coin
+@app.callback(
+    Output(component_id='table_info_coin', component_property='children'),
+    Input('tech_analysis_coin_drop', 'value'))
+
+def plot_info(coin):
+    if coin not in coins:
+        coin = "BTC-USD"
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
+    price_string, price_today = plot_info_coin(coin)
+    return price_string
+
+# 4th callback -> predictions and buy/sell gauge, run as a background callback so a prediction that is still being
+# computed does not occupy a request worker
+@app.callback(
+    [Output(component_id='prediction_tomorrow', component_property='children'),
+    Output(component_id='prediction_tomorrow2', component_property='children'),
+    Output(component_id='buy_sell', component_property='figure'),
+    Output(component_id='gauge_state', component_property='data')],
+    Input('tech_analysis_coin_drop', 'value'),
+    background=True)
+
+def plot_predictions(coin):
+    if coin not in coins:
+        coin = "BTC-USD"
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
     price_string, price_today = plot_info_coin(coin)
     pred1, pred2, price_tom, price_tom2= get_predictions(coin)
+    if price_tom2 is None:
+        return pred1, pred2, go.Figure(), None
     buy_sell_plot = gauge_plot(price_tom2, price_today, 0.2, coin)
-    return ta, ta_vol, price_string, pred1, pred2, buy_sell_plot
+    return pred1, pred2, buy_sell_plot, {"coin": coin, "predicted": float(price_tom2), "interval": 0.2}
+
+# 5th callback -> live updates: the bars and the price the stream received since the last poll are sent as partial
+# updates (dash.Patch) extending the candlestick and volume charts and moving the gauge needle, nothing is sent when
+# nothing changed
+@app.callback(
+    [Output('technical_analysis', 'figure', allow_duplicate=True),
+    Output('technical_analysis_vol', 'figure', allow_duplicate=True),
+    Output('stream_cursor', 'data', allow_duplicate=True),
+    Output('table_info_coin', 'children', allow_duplicate=True),
+    Output('buy_sell', 'figure', allow_duplicate=True)],
+    Input('stream_interval', 'n_intervals'),
+    [State('stream_cursor', 'data'),
+    State('gauge_state', 'data')],
+    prevent_initial_call=True)
+
+def stream_updates(n_intervals, cursor, gauge):
+    if cursor is None:
+        raise PreventUpdate
+    coin = cursor["coin"]
+    seq, klines, complete = live_stream.updates(coin, cursor["interval"], cursor["seq"])
+    ta = ta_vol = info = needle = dash.no_update
+
+    if not complete:
+        # the browser missed bars the ring buffer no longer holds: it gets whole figures again, the next poll adds the
+        # streamed bars to them
+        ta, ta_vol = plot_technical_analyis(coin, cursor["range"], cursor["indicator"])
+        return ta, ta_vol, stream_cursor(coin, cursor["range"], cursor["indicator"], ta, ta_vol), info, needle
+    patches = extend_figures(cursor, klines)
+    if patches is not None:
+        ta, ta_vol = patches
+    cursor["seq"] = seq
+
+    price = live_stream.price(coin)
+    if price is not None and price != cursor["price"]:
+        cursor["price"] = price
+        info = plot_info_coin(coin)[0]
+        if gauge is not None and gauge["coin"] == coin:
+            needle = dash.Patch()
+            needle["layout"]["shapes"][1]["x1"], needle["layout"]["shapes"][1]["y1"] = \
+                gauge_hand(gauge["predicted"], price, gauge["interval"])
+
+    if patches is None and info is dash.no_update:
+        raise PreventUpdate
+    return ta, ta_vol, cursor, info, needle
 
 # ----------------------------------------------------------------------------------------------------------------------
 # Running the app
@@ -0,0 +1,136 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Acquisition benchmark
+#
+# One refresh of the leaderboard frames (every coin on 15m, 60m and 1d bars) against a local stand-in for yahoo and
+# binance that answers after a random latency and fails some requests with 429 / 503, downloaded one request after the
+# other (max_concurrency=1, like the yfinance loop did) and through the acquisition layer at once. The fake host is
+# given the production rate limit of yahoo, whose burst covers the requests of one refresh, so the layer takes a few
+# times the slowest request (16 in flight) rather than the sum of all of them. Also times a stale-while-revalidate
+# read of the prices next to a blocking one.
+#
+#   cd BC5 && python benchmarks/acquisition.py [--coins 20] [--latency 0.05 0.4] [--failures 0.05]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from acquisition import RATE_LIMITS, Acquisition
+
+INTERVALS = {"15m": ("1d", 96), "60m": ("5d", 120), "1d": ("1y", 365)}
+
+
+class FakeUpstream:
+    """yahoo chart and binance ticker endpoints on localhost with random latencies and failures"""
+
+    def __init__(self, latency=(0.05, 0.4), failures=0.05, seed=0):
+        self.latency = latency
+        self.failures = failures
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.failed = 0
+        self.port = None
+
+    async def _answer(self, body):
+        from aiohttp import web
+
+        self.requests += 1
+        await asyncio.sleep(self.random.uniform(*self.latency))
+        if self.random.random() < self.failures:
+            self.failed += 1
+            status = self.random.choice([429, 503])
+            return web.Response(status=status, headers={"Retry-After": "0.1"} if status == 429 else {})
+        return web.json_response(body)
+
+    async def chart(self, request):
+        interval = request.query["interval"]
+        n_bars = INTERVALS[interval][1]
+        step = {"15m": 900, "60m": 3600, "1d": 86400}[interval]
+        end = int(time.time()) // step * step
+        close = (100 * np.exp(np.cumsum(np.random.default_rng(0).normal(0, 0.01, n_bars)))).tolist()
+        quote = {"open": close, "high": close, "low": close, "close": close, "volume": [1e6] * n_bars}
+        result = {"meta": {"exchangeTimezoneName": "UTC"}, "timestamp": list(range(end - step * (n_bars - 1), end + 1, step)),
+                  "indicators": {"quote": [quote], "adjclose": [{"adjclose": close}]}}
+        return await self._answer({"chart": {"result": [result], "error": None}})
+
+    async def prices(self, request):
+        symbols = json.loads(request.query["symbols"])
+        return await self._answer([{"symbol": symbol, "price": "1.0"} for symbol in symbols])
+
+    def start(self):
+        from aiohttp import web
+
+        ready = threading.Event()
+
+        async def serve():
+            app = web.Application()
+            app.router.add_get("/v8/finance/chart/{coin}", self.chart)
+            app.router.add_get("/api/v3/ticker/price", self.prices)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            self.port = site._server.sockets[0].getsockname()[1]
+            ready.set()
+            await asyncio.Event().wait()
+
+        threading.Thread(target=asyncio.run, args=(serve(),), daemon=True).start()
+        ready.wait()
+        return self
+
+
+def refresh(upstream, coins):
+    """downloads every frame of every coin, returns (seconds, number of frames downloaded)"""
+    requests = [(coin, interval, period, None) for interval, (period, _) in INTERVALS.items() for coin in coins]
+    start = time.perf_counter()
+    results = upstream.bars_many(requests)
+    return time.perf_counter() - start, sum(result is not None for result in results)
+
+
+def main():
+    n_coins = int(sys.argv[sys.argv.index("--coins") + 1]) if "--coins" in sys.argv else 20
+    latency = (0.05, 0.4)
+    if "--latency" in sys.argv:
+        position = sys.argv.index("--latency")
+        latency = (float(sys.argv[position + 1]), float(sys.argv[position + 2]))
+    failures = float(sys.argv[sys.argv.index("--failures") + 1]) if "--failures" in sys.argv else 0.05
+
+    fake = FakeUpstream(latency, failures).start()
+    base = f"http://127.0.0.1:{fake.port}"
+    coins = [f"C{i}-USD" for i in range(n_coins)]
+    n_requests = len(coins) * len(INTERVALS)
+    print(f"{n_requests} requests, latency {latency[0]}-{latency[1]}s, {failures:.0%} answered 429/503")
+
+    for name, concurrency in [("one at a time", 1), ("acquisition layer", 16)]:
+        # yahoo and binance share the fake host, it gets the stricter limit of the two
+        upstream = Acquisition(max_concurrency=concurrency, yahoo_url=base + "/v8/finance/chart/",
+                               binance_url=base + "/api/v3/ticker/price",
+                               rate_limits={"127.0.0.1": RATE_LIMITS["query1.finance.yahoo.com"]})
+        before, failed_before = fake.requests, fake.failed
+        seconds, downloaded = refresh(upstream, coins)
+        print("%-20s %8.2f s   %d/%d frames   %d requests (%d failed and retried)"
+              % (name, seconds, downloaded, n_requests, fake.requests - before, fake.failed - failed_before))
+        if concurrency == 1:
+            upstream.close()
+
+    # prices: a blocking download, then a stale value served while it is refreshed in the background
+    fake.failures = 0
+    symbols = {f"C{i}USDT": coin for i, coin in enumerate(coins)}
+    key = ("binance prices",)
+    timings = []
+    for _ in range(2):
+        start = time.perf_counter()
+        upstream.cached(key, 0, lambda: upstream.fetch_prices(symbols))
+        timings.append(time.perf_counter() - start)
+    print("%-20s %8.3f s   stale-while-revalidate %.4f s" % ("prices", timings[0], timings[1]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import psutil
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Callback benchmark
+#
+# Replays recorded market data through the dashboard without network access and reports, for every measured function,
+# the p50 / p95 latency, the peak resident memory of the process while it ran and the bytes it sends to the browser.
+#
+# The fixtures are the daily bars of BC4/data_updated and, if it was recorded, a Binance price snapshot
+# (benchmarks/fixtures/binance_prices.json, see --record). They are written into a scratch directory as the store and
+# snapshot of an app started with OFFLINE=1, with the dates shifted so the last daily bar is today. Recorded data only
+# exists for the BC4 coins and only daily: the coins added in BC5 get a seeded random walk and the 15m / 60m bars of
+# the last week are interpolated from the daily closes with seeded noise.
+#
+#   cd BC5 && python benchmarks/callbacks.py [--repeat 20] [--workspace DIR]
+#   cd BC5 && python benchmarks/callbacks.py --record        (needs network, saves the current Binance prices)
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BC4_DATA = os.path.join(os.path.dirname(APP_DIR), "BC4", "data_updated")
+PRICES_FIXTURE = os.path.join(APP_DIR, "benchmarks", "fixtures", "binance_prices.json")
+FILES = {"Open": "open.csv", "High": "high.csv", "Low": "low.csv", "Close": "close.csv", "Adj Close": "adj_close.csv",
+         "Volume": "volume.csv"}
+
+sys.path.insert(0, APP_DIR)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Fixtures
+
+def recorded_bars(directory, coins, seed=0):
+    """returns {coin: daily bars} from the per field csv files, shifted to end today, random walks for missing coins"""
+    data = pd.concat({field: pd.read_csv(os.path.join(directory, file), index_col="Date", parse_dates=["Date"])
+                      for field, file in FILES.items()}, axis=1)
+    data.index = data.index + (pd.Timestamp.now().normalize() - data.index[-1])
+    bars = {}
+    rng = np.random.default_rng(seed)
+    for coin in coins:
+        if coin in data.columns.get_level_values(1):
+            bars[coin] = data.xs(coin, axis=1, level=1).dropna(how="all")
+            continue
+        index = data.index[-1000:]
+        close = rng.uniform(0.1, 100) * np.exp(np.cumsum(rng.normal(0, 0.04, len(index))))
+        open_ = np.concatenate([[close[0]], close[:-1]])
+        bars[coin] = pd.DataFrame({"Open": open_, "High": np.maximum(open_, close) * 1.02,
+                                   "Low": np.minimum(open_, close) * 0.98, "Close": close, "Adj Close": close,
+                                   "Volume": rng.uniform(1e7, 1e9, len(index))}, index=index.rename("Date"))
+    return bars
+
+
+def intraday_bars(daily, days=7, seed=0):
+    """returns 15 minute bars of the last days, through the daily closes with seeded noise, ending now (UTC)"""
+    rng = np.random.default_rng(seed)
+    index = pd.date_range(end=pd.Timestamp.now(tz="UTC").floor("15min"), periods=days * 96, freq="15min",
+                          name="Datetime")
+    daily = daily.dropna(subset=["Close"]).iloc[-(days + 2):]
+    log_close = np.interp(_seconds(index), _seconds(daily.index.tz_localize("UTC")), np.log(daily["Close"].to_numpy()))
+    noise = np.cumsum(rng.normal(0, 0.002, len(index)))
+    close = np.exp(log_close + noise - np.linspace(0, noise[-1], len(index)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.001, len(index)))
+    volume = daily["Volume"].iloc[-1] / 96 * rng.uniform(0.5, 1.5, len(index))
+    return pd.DataFrame({"Open": open_, "High": np.maximum(open_, close) * (1 + spread),
+                         "Low": np.minimum(open_, close) * (1 - spread), "Close": close, "Adj Close": close,
+                         "Volume": volume}, index=index)
+
+
+def _seconds(index):
+    return np.asarray((index - pd.Timestamp(0, tz="UTC")) / pd.Timedelta(seconds=1))
+
+
+def build_workspace(directory, coins):
+    """writes the store and the snapshot of an offline app into directory"""
+    from ohlcv_store import OHLCVStore
+    from price_feed import binance_name
+
+    store = OHLCVStore(os.path.join(directory, "store"))
+    last_closes = {}
+    for seed, (coin, daily) in enumerate(recorded_bars(BC4_DATA, coins).items()):
+        store.write(coin, "1d", daily, covered_from="max")
+        bars = intraday_bars(daily, seed=seed)
+        store.write(coin, "15m", bars, covered_from=bars.index[0])
+        hourly = bars.resample("60min").agg({"Open": "first", "High": "max", "Low": "min", "Close": "last",
+                                             "Adj Close": "last", "Volume": "sum"})
+        store.write(coin, "60m", hourly, covered_from=hourly.index[0])
+        last_closes[binance_name(coin)] = bars["Close"].iloc[-1]
+
+    if os.path.exists(PRICES_FIXTURE):
+        with open(PRICES_FIXTURE) as file:
+            last_closes.update(json.load(file))
+    prices = pd.DataFrame({"Price": np.round(pd.Series(last_closes, dtype="float64"), 3)})
+    os.makedirs(os.path.join(directory, "snapshot"), exist_ok=True)
+    pd.to_pickle({"prices": prices, "updated": datetime.now()}, os.path.join(directory, "snapshot", "prices.pkl"))
+
+
+def record_prices(coins):
+    """saves the current Binance prices as the price fixture"""
+    from price_feed import PriceFeed
+
+    prices = PriceFeed(coins).fetch()["Price"]
+    os.makedirs(os.path.dirname(PRICES_FIXTURE), exist_ok=True)
+    with open(PRICES_FIXTURE, "w") as file:
+        json.dump({name: float(price) for name, price in prices.items()}, file, indent=1)
+    print(f"saved {len(prices)} prices to {PRICES_FIXTURE}")
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Measures
+
+class PeakRSS:
+    """samples the resident memory of the process in a thread, peak is the highest value seen (MB)"""
+
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.process = psutil.Process()
+        self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        self.peak = self.process.memory_info().rss
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.process.memory_info().rss) / 2 ** 20
+
+
+def measure(function, repeat, before=None, payload=None):
+    """runs function repeat times, returns (p50 ms, p95 ms, peak rss MB, payload bytes)"""
+    times = []
+    sizes = []
+    with PeakRSS() as rss:
+        for _ in range(repeat):
+            if before is not None:
+                before()
+            start = time.perf_counter()
+            result = function()
+            times.append((time.perf_counter() - start) * 1000)
+            if payload is not None:
+                sizes.append(payload(result))
+    return (np.percentile(times, 50), np.percentile(times, 95), rss.peak,
+            int(np.median(sizes)) if len(sizes) > 0 else None)
+
+
+def callback(client, outputs, inputs, changed=0):
+    """returns a function posting a dash callback request (outputs: [(id, property)], inputs: [(id, property, value)]
+    in the order of the callback arguments), inputs[changed] is the one that changed"""
+    body = {
+        "output": ".." + "...".join(f"{id}.{prop}" for id, prop in outputs) + "..",
+        "outputs": [{"id": id, "property": prop} for id, prop in outputs],
+        "inputs": [{"id": id, "property": prop, "value": value} for id, prop, value in inputs],
+        "changedPropIds": [f"{inputs[changed][0]}.{inputs[changed][1]}"],
+        "state": [],
+    }
+
+    def post():
+        response = client.post("/_dash-update-component", json=body)
+        if response.status_code != 200:
+            raise RuntimeError(f"callback {body['output']} answered {response.status_code}")
+        return response.data
+    return post
+
+
+def figures_bytes(figures):
+    import plotly.io as pio
+    return sum(len(pio.to_json(figure, validate=False)) for figure in figures)
+
+
+def run(app, repeat):
+    import forecast
+
+    client = app.app.server.test_client()
+    rows = []
+
+    for lb_range in ["5d", "1mo", "2mo", "3mo", "1y"]:
+        rows.append((f"create_leaderboard({lb_range})",
+                     measure(lambda: app.create_leaderboard(lb_range), repeat, before=app.leaderboard_cache.clear)))
+        leaderboard = callback(client, [("leaderboard", "figure"), ("leaderboard_coins", "figure")],
+                               [("leaderboard_drop", "value", lb_range)])
+        rows.append((f"plot leaderboard ({lb_range})", measure(leaderboard, repeat, payload=len)))
+
+    coin = "BTC-USD"
+    for ta_range in ["1d", "5d", "1mo", "3mo", "1y", "max"]:
+        rows.append((f"plot_technical_analyis({ta_range})",
+                     measure(lambda: app.plot_technical_analyis(coin, ta_range, "EMA"), repeat,
+                             before=app.figure_cache.clear, payload=figures_bytes)))
+        technical_analysis = callback(client, [("technical_analysis", "figure"), ("technical_analysis_vol", "figure"),
+                                                ("stream_cursor", "data")],
+                                      [("tech_analysis_coin_drop", "value", coin),
+                                       ("tech_analysis_range_drop", "value", ta_range),
+                                       ("tech_analysis_indicator_drop", "value", "EMA"),
+                                       ("technical_analysis", "relayoutData", None)], changed=1)
+        rows.append((f"plot technical analysis ({ta_range}, cached)", measure(technical_analysis, repeat, payload=len)))
+
+    closes = app.market_data.frame("1y")["Close", coin].tail(100).to_numpy()
+    rows.append(("forecast.train (ridge)", measure(lambda: forecast.train(closes, "ridge"), repeat)))
+    # the scheduler computes the predictions in its workers, the first call waits for them
+    app.prediction(coin)
+    rows.append((f"prediction({coin})", measure(lambda: app.prediction(coin), repeat)))
+
+    app.prediction_scheduler.shutdown()
+    return rows
+
+
+def main():
+    repeat = int(sys.argv[sys.argv.index("--repeat") + 1]) if "--repeat" in sys.argv else 20
+    workspace = sys.argv[sys.argv.index("--workspace") + 1] if "--workspace" in sys.argv else tempfile.mkdtemp()
+
+    # the app is imported offline from the workspace, then the fixtures of its coins are written there and loaded
+    os.makedirs(workspace, exist_ok=True)
+    os.chdir(workspace)
+    os.environ["OFFLINE"] = "1"
+    os.environ["WARMUP"] = "0"
+    shutil.copy(os.path.join(APP_DIR, "crypto.png"), workspace)
+    import app
+
+    if "--record" in sys.argv:
+        record_prices(app.coins)
+        return
+    build_workspace(workspace, app.coins)
+    app.market_data.load_snapshot()
+    if not app.market_data.wait(timeout=0):
+        raise RuntimeError("the fixture snapshot was not loaded")
+    app.prediction_scheduler.refresh()
+    rows = run(app, repeat)
+
+    print(f"{repeat} runs each, workspace {workspace}")
+    print("%-44s %10s %10s %10s %12s" % ("function", "p50 ms", "p95 ms", "peak MB", "bytes"))
+    for name, (p50, p95, peak, size) in rows:
+        print("%-44s %10.1f %10.1f %10.1f %12s" % (name, p50, p95, peak, "-" if size is None else size))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Indicator benchmark
+#
+# Checks the incremental indicators against the pandas rolling/ewm calls they replace on closes with missing bars
+# (single NaNs and a long gap): computed at once, appended one bar at a time through the gap, with the last bar
+# revised, and for a range starting inside bars already computed. Then times a full computation next to a one bar
+# update.
+#
+#   cd BC5 && python benchmarks/indicators.py [--bars 3000] [--repeat 200]
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from indicators import IndicatorEngine
+
+WINDOWS = (100, 200, 30)
+
+
+def closes(n_bars, seed=1):
+    """random walk with a few missing closes and a gap of 40 bars"""
+    rng = np.random.default_rng(seed)
+    close = pd.Series(100 * np.exp(np.cumsum(rng.normal(0, 0.01, n_bars))),
+                      index=pd.date_range("2015-01-01", periods=n_bars))
+    close.iloc[[0, 1, n_bars // 6, n_bars // 6 + 1, n_bars - 10]] = np.nan
+    close.iloc[2 * n_bars // 3:2 * n_bars // 3 + 40] = np.nan
+    return close
+
+
+def reference(close, short_window, long_window, boll_window, indicator):
+    """the columns as plot_technical_analyis() computed them with pandas"""
+    df = pd.DataFrame(index=close.index)
+    df['sma'] = close.rolling(window = boll_window).mean()
+    df['std'] = close.rolling(window = boll_window).std(ddof = 0)
+    for window in [short_window, long_window]:
+        if indicator == "SMA":
+            df[str(window) + '_SMA'] = close.rolling(window = window, min_periods = 1).mean()
+        else:
+            df[str(window) + '_EMA'] = close.ewm(span = window, adjust = False).mean()
+    df['Signal'] = np.where(df.iloc[:, 2] > df.iloc[:, 3], 1.0, 0.0)
+    df['Position'] = df['Signal'].diff()
+    return df
+
+
+def check(name, got, expected):
+    same = got.index.equals(expected.index) and got.columns.equals(expected.columns) and \
+        np.allclose(got.to_numpy(), expected.to_numpy(), rtol=1e-7, atol=1e-6, equal_nan=True)
+    print("%-40s %s" % (name, "ok" if same else "MISMATCH"))
+    return same
+
+
+def checks(close):
+    n_bars = len(close)
+    gap = 2 * n_bars // 3
+    ok = True
+    for indicator in ["EMA", "SMA"]:
+        engine = IndicatorEngine()
+        ok &= check(f"{indicator} at once", engine.compute("X", "1d", close, *WINDOWS, indicator),
+                    reference(close, *WINDOWS, indicator))
+
+        engine = IndicatorEngine()
+        engine.compute("X", "1d", close.iloc[:gap - 10], *WINDOWS, indicator)
+        for end in range(gap - 9, gap + 60):
+            got = engine.compute("X", "1d", close.iloc[:end], *WINDOWS, indicator)
+        ok &= check(f"{indicator} appended through the gap", got, reference(close.iloc[:end], *WINDOWS, indicator))
+
+        revised = close.iloc[:gap + 100].copy()
+        engine.compute("X", "1d", revised, *WINDOWS, indicator)
+        revised.iloc[-1] *= 1.05
+        ok &= check(f"{indicator} last bar revised", engine.compute("X", "1d", revised, *WINDOWS, indicator),
+                    reference(revised, *WINDOWS, indicator))
+
+        # a shorter range, or the same one a bar later: computed over its own bars, as pandas does
+        engine = IndicatorEngine()
+        engine.compute("X", "1d", close.iloc[:-1], *WINDOWS, indicator)
+        ok &= check(f"{indicator} shorter range", engine.compute("X", "1d", close.iloc[-365:], *WINDOWS, indicator),
+                    reference(close.iloc[-365:], *WINDOWS, indicator))
+        ok &= check(f"{indicator} window slid", engine.compute("X", "1d", close.iloc[1:], *WINDOWS, indicator),
+                    reference(close.iloc[1:], *WINDOWS, indicator))
+    return ok
+
+
+def main():
+    n_bars = int(sys.argv[sys.argv.index("--bars") + 1]) if "--bars" in sys.argv else 3000
+    repeat = int(sys.argv[sys.argv.index("--repeat") + 1]) if "--repeat" in sys.argv else 200
+    close = closes(n_bars)
+    ok = checks(close)
+
+    for indicator in ["EMA", "SMA"]:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            IndicatorEngine().compute("X", "1d", close, *WINDOWS, indicator)
+        full = (time.perf_counter() - start) / repeat
+
+        engine = IndicatorEngine()
+        engine.compute("X", "1d", close.iloc[:n_bars - repeat], *WINDOWS, indicator)
+        start = time.perf_counter()
+        for end in range(n_bars - repeat + 1, n_bars + 1):
+            engine.compute("X", "1d", close.iloc[:end], *WINDOWS, indicator)
+        update = (time.perf_counter() - start) / repeat
+        print("%-4s %d bars   full %7.2f ms   one new bar %7.2f ms" % (indicator, n_bars, full * 1000, update * 1000))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import plotly.graph_objs as go
+import plotly.io as pio
+from plotly.utils import PlotlyJSONEncoder
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Payload benchmark
+#
+# Size and server side encoding time of the figures each chart callback sends, in three encodings: JSON lists of
+# numbers and ISO date strings (what plotly < 6 sends), plotly's own encoding of the installed version and the typed
+# arrays of figure_encoding.py. The bars are random walks with the length of the real ranges, so the run needs no
+# network or store.
+#
+#   cd BC5 && python benchmarks/payload.py
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import charts
+from figure_encoding import _decode, compact_figure
+from indicators import IndicatorEngine
+
+# bars of every technical analysis range
+BARS = {"1d": 96, "5d": 480, "1mo": 30, "3mo": 90, "1y": 365, "max": 3000}
+
+
+def random_bars(n_bars, interval, seed=0):
+    """returns n_bars OHLCV bars of a random walk, indexed like the store returns them"""
+    rng = np.random.default_rng(seed)
+    if interval == "15m":
+        index = pd.date_range(end="2022-06-01", periods=n_bars, freq="15min", tz="UTC", name="Datetime")
+    else:
+        index = pd.date_range(end="2022-06-01", periods=n_bars, freq="D", name="Date")
+    close = 30000 * np.exp(np.cumsum(rng.normal(0, 0.02, n_bars)))
+    open_ = np.concatenate([[close[0]], close[:-1]])
+    spread = np.abs(rng.normal(0, 0.01, n_bars)) * close
+    return pd.DataFrame({"Open": open_, "High": np.maximum(open_, close) + spread,
+                         "Low": np.minimum(open_, close) - spread, "Close": close, "Adj Close": close,
+                         "Volume": rng.uniform(1e9, 5e10, n_bars)}, index=index)
+
+
+def as_lists(figure):
+    """the figure with its arrays as JSON lists and its dates as ISO strings"""
+    figure = figure.to_plotly_json()
+    for trace in figure["data"]:
+        for name, values in trace.items():
+            if isinstance(values, dict) and "bdata" in values:
+                trace[name] = _decode(values).tolist()
+            elif isinstance(values, (np.ndarray, pd.Index)):
+                trace[name] = [value.isoformat() if hasattr(value, "isoformat") else value for value in values]
+    return figure
+
+
+def measure(figure, repeat=5):
+    """returns {encoding: (bytes, milliseconds)} for one figure"""
+    encoders = {
+        "json lists": lambda: json.dumps(as_lists(figure), cls=PlotlyJSONEncoder),
+        "plotly": lambda: pio.to_json(figure),
+        "typed arrays": lambda: pio.to_json(compact_figure(figure), validate=False),
+    }
+    results = {}
+    for name, encode in encoders.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            payload = encode()
+        results[name] = (len(payload), (time.perf_counter() - start) / repeat * 1000)
+    return results
+
+
+def leaderboard_coins(data):
+    """the top 2 / worst 2 line charts of the leaderboard callback over one year"""
+    from plotly.subplots import make_subplots
+
+    figure = make_subplots(rows = 2, cols = 2)
+    for i, column in enumerate(data.columns):
+        figure.add_trace(go.Scatter(x = data.index, y = data[column], fill="tozeroy"), row = i // 2 + 1, col = i % 2 + 1)
+    return figure
+
+
+def main():
+    rows = []
+    for range, n_bars in BARS.items():
+        interval = charts.ta_parameters(range)[0]
+        bars = random_bars(n_bars, interval)
+        ta, ta_vol = charts.technical_analysis("BTC-USD", range, "EMA", bars, IndicatorEngine(), compact=False)
+        rows.append(("technical_analysis " + range, measure(ta)))
+        rows.append(("technical_analysis_vol " + range, measure(ta_vol)))
+    closes = pd.DataFrame({coin: random_bars(365, "1d", seed)["Close"] for seed, coin in enumerate("ABCD")})
+    rows.append(("leaderboard_coins 1y", measure(leaderboard_coins(closes))))
+
+    print("%-28s %24s %24s %24s" % ("figure", "json lists", "plotly", "typed arrays"))
+    for name, results in rows:
+        cells = ["%9d B %8.1f ms" % results[encoding] for encoding in ["json lists", "plotly", "typed arrays"]]
+        ratio = results["json lists"][0] / results["typed arrays"][0]
+        print("%-28s %24s %24s %24s   %.1fx smaller" % ((name,) + tuple(cells) + (ratio,)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import json
+import os
+import subprocess
+import sys
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Startup benchmark
+#
+# Measures what a fresh worker pays before it can answer: the import time of the heavy dependencies on their own, the
+# import time of app.py and the time to the first responses of the index page and of the layout. Every measure runs in
+# a new interpreter so nothing is already imported.
+#
+#   cd BC5 && python benchmarks/startup.py [--runs 5]
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = ["pandas", "dash", "dash_bootstrap_components", "plotly.subplots", "aiohttp", "sklearn.linear_model",
+           "tensorflow"]
+
+# marks the json line among what the app threads (warm-up, live stream) print
+RESULT = "startup result: "
+
+# runs inside the child interpreter, prints one json line
+IMPORT_MODULE = """
+import json, sys, time
+start = time.perf_counter()
+try:
+    __import__(sys.argv[1])
+except ImportError as error:
+    print(sys.argv[2] + json.dumps({"error": str(error)}))
+else:
+    print(sys.argv[2] + json.dumps({"seconds": time.perf_counter() - start}))
+"""
+
+IMPORT_APP = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.app.server.test_client()
+index = client.get("/")
+index_done = time.perf_counter()
+layout = client.get("/_dash-layout")
+layout_done = time.perf_counter()
+heavy = [name for name in ["aiohttp", "sklearn", "tensorflow", "plotly.subplots"] if name in sys.modules]
+print(sys.argv[1] + json.dumps({
+    "import": imported - start,
+    "first index": index_done - imported,
+    "first layout": layout_done - index_done,
+    "status": [index.status_code, layout.status_code],
+    "peak rss MB": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "heavy modules loaded": heavy,
+}))
+"""
+
+
+def run(code, *args):
+    """runs code in a fresh interpreter from the app directory and returns its json output"""
+    output = subprocess.run([sys.executable, "-c", code] + list(args) + [RESULT], cwd=APP_DIR, capture_output=True,
+                            text=True, check=True).stdout
+    line = next(line for line in output.splitlines() if line.startswith(RESULT))
+    return json.loads(line[len(RESULT):])
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main(runs=5):
+    print("import time of the dependencies (median of %d runs)" % runs)
+    for module in MODULES:
+        results = [run(IMPORT_MODULE, module) for _ in range(runs)]
+        if "error" in results[0]:
+            print("  %-28s not installed" % module)
+        else:
+            print("  %-28s %7.3f s" % (module, median([result["seconds"] for result in results])))
+
+    # the app starts its refresh threads on import, they only read the snapshot on disk within these timings
+    results = [run(IMPORT_APP) for _ in range(runs)]
+    print("app startup (median of %d runs)" % runs)
+    for name in ["import", "first index", "first layout"]:
+        print("  %-28s %7.3f s" % (name, median([result[name] for result in results])))
+    print("  %-28s %7.1f MB" % ("peak rss", median([result["peak rss MB"] for result in results])))
+    print("  %-28s %s" % ("status codes", results[-1]["status"]))
+    print("  %-28s %s" % ("heavy modules loaded", ", ".join(results[-1]["heavy modules loaded"]) or "none"))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[sys.argv.index("--runs") + 1]) if "--runs" in sys.argv else 5)
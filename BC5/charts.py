@@ -0,0 +1,230 @@
+import os
+
+import pandas as pd
+import plotly.graph_objs as go
+
+from downsample import lttb, ohlc_buckets
+from figure_encoding import compact_figure
+from metrics import Stopwatch
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Technical analysis charts
+#
+# Builds the candlestick and volume figures of plot_technical_analyis() from bars that were already loaded, without
+# touching the market data, so they can also be built in the warm-up worker processes (warmup.py).
+#
+# Every trace is reduced to about POINT_BUDGET points (downsample.py). Zooming in on the candlestick chart rebuilds the
+# figures for the visible range only, which is at full resolution as soon as it fits the budget.
+#
+# The last trace of both figures is empty: the bars the live stream (stream.py) receives after the figures were built
+# are appended to it in the browser.
+
+POINT_BUDGET = int(os.environ.get("CHART_POINTS", 1000))
+
+
+def ta_parameters(range):
+    """returns (interval, short_window, long_window, boll_window) of the technical analysis over range"""
+    if (range in ["1d", "5d"]):
+        return "15m", 9, 21, 18
+    return "1d", 100, 200, 30
+
+
+def data_version(df):
+    """identifies the bars a figure was built from: a new bar or an update of the last one changes it"""
+    if len(df) == 0:
+        return (0, None, None)
+    return (len(df), df.index[-1], float(df["Close"].iloc[-1]))
+
+
+def zoom_range(relayout):
+    """returns the (start, end) of the x axis a relayoutData event zoomed to, None when it went back to the whole
+    range and False when it did not touch the x axis"""
+    if not relayout:
+        return False
+    if "xaxis.range[0]" in relayout and "xaxis.range[1]" in relayout:
+        return relayout["xaxis.range[0]"], relayout["xaxis.range[1]"]
+    if "xaxis.range" in relayout:
+        return tuple(relayout["xaxis.range"])
+    if relayout.get("xaxis.autorange"):
+        return None
+    return False
+
+
+def _bounds(index, x_range):
+    """converts the bounds plotly sends (wall time strings) to timestamps comparable with index"""
+    bounds = [pd.Timestamp(bound) for bound in x_range]
+    tz = getattr(index, "tz", None)
+    if tz is not None:
+        bounds = [bound.tz_localize(tz) if bound.tzinfo is None else bound.tz_convert(tz) for bound in bounds]
+    return bounds
+
+
+def _line(series, max_points):
+    """returns the points of series LTTB keeps"""
+    return series.iloc[lttb(series.index, series.to_numpy(), max_points)]
+
+
+def technical_analysis(coin, range, indicator, df, indicator_engine, x_range=None, max_points=None, compact=True):
+    """returns the candlestick (with moving averages, buy/sell signals and bollinger bands) and volume figures as dicts
+
+    x_range limits the figures to the bars between its (start, end), every trace keeps at most about max_points
+    points (POINT_BUDGET by default). compact=False returns the go.Figure objects instead"""
+    max_points = max_points or POINT_BUDGET
+    interval, short_window, long_window, boll_window = ta_parameters(range)
+    stopwatch = Stopwatch("technical_analysis")
+
+    # column names for long and short moving average columns
+    short_window_col = str(short_window) + '_' + indicator
+    long_window_col = str(long_window) + '_' + indicator 
+
+    # bollinger sma/std, short and long moving averages, Signal (1 when the short average is above the long one) and
+    # Position (day-to-day difference of Signal), only the new bars are computed when the coin was already shown
+    indicators = indicator_engine.compute(coin, interval, df['Close'], short_window, long_window, boll_window, indicator)
+    df = pd.concat([df, indicators], axis=1)
+    stopwatch.lap("indicators")
+
+    # the indicators are computed over every bar, so a zoomed figure shows the same values as the whole one
+    if x_range is not None:
+        start, end = _bounds(df.index, x_range)
+        df = df.loc[start:end]
+    x_axis = df.index
+
+    # what the traces draw: coarser candles and the LTTB points of the lines once there are more bars than the budget
+    candles = ohlc_buckets(df, max_points)
+    short_line = _line(df[short_window_col], max_points)
+    long_line = _line(df[long_window_col], max_points)
+    upper_band = _line(df["sma"] + (df['std'] * 2), max_points)
+    lower_band = _line(df["sma"] - (df['std'] * 2), max_points)
+    stopwatch.lap("downsample")
+    
+    layout = go.Layout(
+        autosize=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)',
+    
+        xaxis= go.layout.XAxis(linecolor = 'black',
+                              linewidth = 1,
+                              mirror = True),
+    
+        yaxis= go.layout.YAxis(linecolor = 'black',
+                              linewidth = 1,
+                              mirror = True),
+    
+        margin=go.layout.Margin(
+            l=50,
+            r=50,
+            b=100,
+            t=100,
+            pad = 4
+        )
+    )
+    
+    fig1 = go.Figure(
+    
+        data=[go.Candlestick(
+        x=candles.index,
+        open=candles['Open'], high=candles['High'],
+        low=candles['Low'], close=candles['Close'],
+        increasing_line_color= 'Green', decreasing_line_color= 'Red'
+    ), #
+                go.Scatter(
+                    x = short_line.index, 
+                    y = short_line,
+                    mode = 'lines', 
+                    name = short_window_col,
+                    line = {'color': '#00ff11'}
+                ),
+                go.Scatter(
+                    x = long_line.index, 
+                    y = long_line,
+                    mode = 'lines',
+                    name = long_window_col,
+                    line = {'color': '#ff0008'}
+                ),
+                go.Scatter(
+                    x = x_axis[df["Position"] == -1], 
+                    y = df[long_window_col][df["Position"] == -1],
+                    mode = 'markers',
+                    marker= dict(symbol='triangle-down', size = 14),
+                    name = 'Sell',
+                    line = {'color': '#ff0000'}
+                ),
+                go.Scatter(
+                    x = x_axis[df["Position"] == 1], 
+                    y = df[short_window_col][df["Position"] == 1],
+                    mode = 'markers',
+                    marker= dict(symbol='triangle-up', size = 14),
+                    name = 'Buy',
+                    line = {'color': '#00ff95'}
+                ), 
+                 go.Scatter(
+                    x = upper_band.index, 
+                    y = upper_band,
+                    line_color = 'gray',
+                    line = {'dash': 'dash'},
+                    name = 'upper band',
+                    opacity = 0.3
+                ),
+                go.Scatter(
+                    x = lower_band.index, 
+                    y = lower_band,
+                    line_color = 'gray',
+                    line = {'dash': 'dash'},
+                    fill = 'tonexty',
+                    name = 'lower band',
+                    opacity = 0.3
+                ),
+                go.Candlestick(
+                    x = [], open = [], high = [], low = [], close = [],
+                    name = 'live',
+                    showlegend = False,
+                    increasing_line_color= 'Green', decreasing_line_color= 'Red'
+                ),
+            ]
+        ,layout=layout)
+
+    fig2 = go.Figure(
+                data = [go.Bar(
+                    x = candles.index,
+                    y = candles["Volume"],
+                    marker_color = "#85acc9"
+                ),
+                go.Bar(
+                    x = [], y = [],
+                    name = 'live',
+                    marker_color = "#85acc9"
+                )]
+    )
+
+    fig2.update_layout(
+        title = f'The Barchart graph showing volume for {coin}',
+        xaxis_title = 'Date',
+        yaxis_title = 'Amount of asset traded during the day',
+        xaxis_rangeslider_visible = False,
+        # the live bars are drawn over the bars of the same date instead of next to them
+        barmode = 'overlay',
+        showlegend = False,
+        autosize=False,
+        paper_bgcolor='rgba(0,0,0,0)',
+        plot_bgcolor='rgba(0,0,0,0)'
+    )
+
+    fig1.update_layout(
+        legend=dict(yanchor="top", y=0.9, xanchor="left", x=0.06),
+        title = f'The Candlestick graph for {coin}',
+        xaxis_title = 'Date',
+        yaxis_title = coin,
+        xaxis_rangeslider_visible = False #DEFAULT TRUE, WHILE TAKING SCREENSHOT WE PUT IT TO FALSE
+    )
+
+    if x_range is not None:
+        fig1.update_layout(xaxis_range = list(x_range))
+        fig2.update_layout(xaxis_range = list(x_range))
+
+    stopwatch.lap("figure")
+    if not compact:
+        return fig1, fig2
+    # sent as typed arrays (figure_encoding.py)
+    fig1, fig2 = compact_figure(fig1), compact_figure(fig2)
+    stopwatch.lap("encode")
+    return fig1, fig2
@@ -0,0 +1,317 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+
+from acquisition import Acquisition, UpstreamError
+from ohlcv_store import FIELDS, INTRADAY, to_utc
+from request_cache import CoalescingCache
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Market data provider
+#
+# Nothing is downloaded when the app is imported: the provider starts from the bars kept in the local OHLCV store
+# (ohlcv_store.py) and fetches fresh data in a background thread. The callbacks read the frames through the provider and wait (briefly) only
+# when the very first fetch has not finished and there is no snapshot yet.
+#
+# After the first load the frames are updated every refresh_seconds by downloading only the bars after the last stored
+# timestamp of each interval, so a long running server keeps showing current leaderboards. The bars of every coin and
+# interval are requested at once through the acquisition layer (acquisition.py), a refresh waits for the slowest
+# request only.
+#
+# An offline provider (offline=True) never downloads: it serves the snapshot and the store as they are, which is how
+# the benchmarks replay their recorded fixtures.
+
+# leaderboard frame -> (yahoo period, bar interval, length of the window kept)
+FRAMES = {
+    "1d": ("1d", "15m", relativedelta(days=1)),
+    "5d": ("5d", "60m", relativedelta(days=5)),
+    "1y": ("1y", "1d", relativedelta(years=1)),
+}
+
+# leaderboard range -> (frame it is a view of, length of the range)
+RANGES = {
+    "1d": ("1d", relativedelta(days=1)),
+    "5d": ("5d", relativedelta(days=5)),
+    "1mo": ("1y", relativedelta(months=1)),
+    "2mo": ("1y", relativedelta(months=2)),
+    "3mo": ("1y", relativedelta(months=3)),
+    "1y": ("1y", relativedelta(years=1)),
+}
+
+# technical analysis range -> length of the period
+PERIODS = {
+    "1d": relativedelta(days=1),
+    "5d": relativedelta(days=5),
+    "1mo": relativedelta(months=1),
+    "3mo": relativedelta(months=3),
+    "1y": relativedelta(years=1),
+    "max": None,
+}
+BARS = {"15m": timedelta(minutes=15), "60m": timedelta(hours=1), "1d": timedelta(days=1)}
+# how long (seconds) a technical analysis history is served from memory before the store / yahoo is checked again
+HISTORY_TTL = {"15m": 60, "60m": 300, "1d": 3600}
+# how long (seconds) yahoo is not asked again for the bars of a coin and interval after a failed download, the stored
+# bars are served meanwhile
+RETRY_SECONDS = 60
+
+
+class MarketData:
+    """leaderboard frames and binance prices, loaded from a local snapshot and refreshed in the background"""
+
+    def __init__(self, coins, price_feed, store, directory="snapshot", refresh_seconds=900, offline=False,
+                 upstream=None):
+        self.coins = list(coins)
+        self.offline = offline
+        self.price_feed = price_feed
+        self.upstream = upstream or Acquisition()
+        self.store = store
+        self.refresh_seconds = refresh_seconds
+        self.path = os.path.join(directory, "prices.pkl")
+        self.snapshot = None
+        self._loaded = threading.Event()
+        self._listeners = []
+        self._thread = None
+        # leaderboard range -> (snapshot, first row of the range in its frame)
+        self._bounds = {}
+        self._histories = CoalescingCache(max_entries=256, name="history")
+        # (coin, interval) -> unix time until which a failed download is not tried again
+        self._failed = {}
+
+    def start(self):
+        """loads the last snapshot from disk and starts the background updates"""
+        if self._thread is not None:
+            return
+        self.load_snapshot()
+        if self.offline:
+            return
+        self._thread = threading.Thread(target=self._run, name="market-data", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, listener):
+        """listener() is called after every successful refresh"""
+        self._listeners.append(listener)
+
+    def load_snapshot(self):
+        """builds the leaderboard frames from the store and the prices from the last saved ones"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            snapshot = pd.read_pickle(self.path)
+            columns = pd.MultiIndex.from_product([FIELDS, self.coins])
+            for name, (period, interval, window) in FRAMES.items():
+                # the window ends at the last stored bar rather than now, so a server that was down for longer than
+                # the window still starts from its last frames
+                last = [self.store.last_timestamp(coin, interval) for coin in self.coins]
+                last = [to_utc(timestamp) for timestamp in last if timestamp is not None]
+                if len(last) == 0:
+                    return
+                bars = {}
+                for coin in self.coins:
+                    data = self.store.read(coin, interval, start=max(last) - window)
+                    if data is not None and len(data) > 0:
+                        bars[coin] = data
+                # the coins without stored bars are left empty, like in _download_frames
+                snapshot[name] = pd.concat(bars, axis=1).swaplevel(axis=1).reindex(columns=columns).sort_index(axis=1)
+        except Exception as error:
+            print(f"market data: could not read the snapshot ({error})")
+            return
+        self.price_feed.seed(snapshot["prices"], snapshot["updated"].timestamp())
+        self._swap(snapshot)
+
+    def save_snapshot(self, snapshot, full=False, names=FRAMES):
+        """writes the bars of every coin of the frames names (the ones downloaded) to the store and the prices next to
+        it"""
+        now = pd.Timestamp.now(tz="UTC")
+        for name in names:
+            period, interval, window = FRAMES[name]
+            for coin in self.coins:
+                covered_from = now - window if full else None
+                self.store.write(coin, interval, snapshot[name].xs(coin, axis=1, level=1), covered_from=covered_from)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        pd.to_pickle({"prices": snapshot["prices"], "updated": snapshot["updated"]}, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def _swap(self, snapshot):
+        # the range views below rely on sorted frames
+        for name in FRAMES:
+            if not snapshot[name].index.is_monotonic_increasing:
+                snapshot[name] = snapshot[name].sort_index()
+        # a single reference assignment, readers always see a complete snapshot
+        self.snapshot = snapshot
+        self._loaded.set()
+
+    def _run(self):
+        while True:
+            try:
+                if self.snapshot is None:
+                    self.refresh()
+                else:
+                    self.update()
+            except Exception as error:
+                print(f"market data: refresh failed, serving the last snapshot ({error})")
+            time.sleep(self.refresh_seconds)
+
+    def _publish(self, snapshot, full=False, names=FRAMES):
+        self.save_snapshot(snapshot, full, names)
+        self._swap(snapshot)
+        for listener in self._listeners:
+            listener()
+
+    def refresh(self):
+        """downloads every frame and price, stores the snapshot on disk and swaps it in"""
+        # the prices are served stale-while-revalidate, their refresh runs next to the downloads of the bars
+        prices = self.price_feed.prices()
+        new = self._download_frames({name: None for name in FRAMES})
+        old = self.snapshot
+        snapshot = {}
+        for name in FRAMES:
+            # a frame none of the coins could be downloaded for stays as it was
+            if name in new:
+                snapshot[name] = new[name]
+            elif old is not None:
+                snapshot[name] = old[name]
+            else:
+                snapshot[name] = pd.DataFrame(columns=pd.MultiIndex.from_product([FIELDS, self.coins]),
+                                              index=pd.DatetimeIndex([]), dtype="float64")
+        snapshot["prices"] = prices
+        snapshot["updated"] = datetime.now()
+        self._publish(snapshot, full=True, names=list(new))
+
+    def update(self):
+        """downloads only the bars after the last stored one of each frame, appends them and trims the windows"""
+        old = self.snapshot
+        prices = self.price_feed.prices()
+        # the last stored bar is downloaded again, it may have been incomplete
+        new = self._download_frames({name: old[name].index[-1] if len(old[name]) > 0 else None for name in FRAMES})
+        snapshot = {}
+        for name, (period, interval, window) in FRAMES.items():
+            if name not in new:
+                snapshot[name] = old[name]
+            elif len(old[name]) == 0:
+                snapshot[name] = new[name]
+            else:
+                snapshot[name] = append_bars(old[name], new[name], window)
+        snapshot["prices"] = old["prices"] if prices is None else prices
+        snapshot["updated"] = datetime.now()
+        self._publish(snapshot, names=list(new))
+
+    def _download_frames(self, starts):
+        """downloads the bars of every coin of the frames in starts ({frame name: start, None for its whole period})
+        at once, returns {frame name: bars with (field, coin) columns} without the frames none of the coins were
+        downloaded for"""
+        requests = [(name, coin) for name in starts for coin in self.coins]
+        results = self.upstream.bars_many([(coin, FRAMES[name][1], FRAMES[name][0], starts[name])
+                                           for name, coin in requests])
+        if all(result is None for result in results):
+            raise UpstreamError("no bars were downloaded")
+        frames = {}
+        for name in starts:
+            bars = {coin: result for (frame, coin), result in zip(requests, results)
+                    if frame == name and result is not None}
+            if len(bars) == 0:
+                print(f"market data: no bars of the {name} frame were downloaded, it is kept as it was")
+                continue
+            # the coins that failed are left empty, like yfinance does
+            columns = pd.MultiIndex.from_product([FIELDS, self.coins])
+            frames[name] = pd.concat(bars, axis=1).swaplevel(axis=1).reindex(columns=columns).sort_index(axis=1)
+        return frames
+
+    def history(self, coin, period="max", interval="1d"):
+        """returns the bars of one coin over a technical analysis range (see PERIODS) from the store
+
+        only what the store is missing is downloaded: the whole period the first time, afterwards the bars after the
+        last stored one. The result is kept in memory for HISTORY_TTL seconds and concurrent requests for the same
+        (coin, period, interval) share one download. When yahoo cannot be reached the stored bars are served, and
+        kept only until the download is tried again (RETRY_SECONDS). The returned frame is shared, it must not be
+        modified."""
+        return self._histories.get((coin, period, interval), lambda: self._history_ttl(coin, interval),
+                                   lambda: self._load_history(coin, period, interval))
+
+    def _history_ttl(self, coin, interval):
+        retry = self._failed.get((coin, interval), 0) - time.time()
+        return HISTORY_TTL[interval] if retry <= 0 else min(HISTORY_TTL[interval], retry)
+
+    def _load_history(self, coin, period, interval):
+        start = None if PERIODS[period] is None else pd.Timestamp.now(tz="UTC") - PERIODS[period]
+        if not self.offline and self._failed.get((coin, interval), 0) <= time.time():
+            try:
+                self._download_missing(coin, period, interval, start)
+            except UpstreamError as error:
+                print(f"market data: {coin} {interval} bars not downloaded, serving the stored ones ({error})")
+                self._failed[coin, interval] = time.time() + RETRY_SECONDS
+            else:
+                self._failed.pop((coin, interval), None)
+        data = self.store.read(coin, interval, start=start)
+        if data is None:
+            # nothing stored (the download failed): empty charts rather than a failing callback
+            index = pd.DatetimeIndex([], name="Datetime" if interval in INTRADAY else "Date")
+            data = pd.DataFrame(columns=FIELDS, index=index, dtype="float64")
+        return data
+
+    def _download_missing(self, coin, period, interval, start):
+        """downloads into the store the bars since start it does not have yet"""
+        if not self.store.covers(coin, interval, start):
+            data = self.upstream.bars(coin, interval, period=period)
+            self.store.write(coin, interval, data, covered_from="max" if start is None else start)
+        else:
+            last = self.store.last_timestamp(coin, interval)
+            if to_utc(pd.Timestamp.now(tz="UTC")) - to_utc(last) > BARS[interval]:
+                data = self.upstream.bars(coin, interval, start=to_utc(last))
+                self.store.write(coin, interval, data)
+
+    def wait(self, timeout=None):
+        """blocks until data is available, returns False on timeout"""
+        return self._loaded.wait(timeout)
+
+    def frame(self, lb_range="1y"):
+        """returns the frame of the range (1d, 5d, 1mo, 2mo, 3mo, 1y) or None before the first load
+
+        the ranges are positional slices (views, no copy) of the stored frames. The first row of a range only moves
+        forward while time passes, so it is searched from where it was found last time."""
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        name, length = RANGES[lb_range]
+        data = snapshot[name]
+        if len(data) == 0:
+            return data
+
+        now = pd.Timestamp.now(tz=data.index.tz)
+        # a snapshot that is not up to date is measured from its last bar
+        cutoff = min(now, data.index[-1]) - length
+
+        bounds = self._bounds.get(lb_range)
+        start = bounds[1] if bounds is not None and bounds[0] is snapshot else 0
+        position = start + data.index[start:].searchsorted(cutoff, side="left")
+        self._bounds[lb_range] = (snapshot, position)
+        return data.iloc[position:]
+
+    @property
+    def version(self):
+        """changes every time a new snapshot is swapped in"""
+        snapshot = self.snapshot
+        return None if snapshot is None else snapshot["updated"]
+
+    @property
+    def prices(self):
+        """returns the live binance prices (cached by the price feed), the snapshot ones if binance is unreachable"""
+        prices = self.price_feed.prices()
+        if prices is None and self.snapshot is not None:
+            prices = self.snapshot["prices"]
+        return prices
+
+
+def append_bars(data, new, window):
+    """returns data with the bars of new appended and cut to the last window
+
+    on overlapping timestamps the values of new win, cell by cell: a coin whose download failed (an empty column in
+    new) keeps its bars"""
+    if len(new) == 0:
+        return data
+    data = new.combine_first(data).reindex(columns=data.columns.union(new.columns)).sort_index()
+    return data.loc[data.index > data.index[-1] - window]
@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Downsampling of the chart series
+#
+# A "max" chart has a candle per day since the coin was listed, more than a browser needs for a few hundred pixels.
+# The candles are re-aggregated into coarser buckets (first open, highest high, lowest low, last close, summed volume)
+# and the lines keep the points chosen by largest triangle three buckets (LTTB), which preserves the peaks and troughs
+# a plain every-nth-point sampling would miss.
+
+
+def ohlc_buckets(df, n_buckets):
+    """returns df re-aggregated into n_buckets consecutive buckets of (almost) equal size, indexed by the first bar of
+    each bucket"""
+    if len(df) <= n_buckets:
+        return df
+    groups = np.arange(len(df)) * n_buckets // len(df)
+    starts = np.flatnonzero(np.diff(groups, prepend=-1))
+    grouped = df.groupby(groups)
+    columns = {"Open": grouped["Open"].first(), "High": grouped["High"].max(), "Low": grouped["Low"].min(),
+               "Close": grouped["Close"].last()}
+    if "Volume" in df.columns:
+        columns["Volume"] = grouped["Volume"].sum()
+    buckets = pd.DataFrame(columns)
+    buckets.index = df.index[starts]
+    return buckets
+
+
+def lttb(x, y, n_out):
+    """returns the positions of the n_out points of (x, y) kept by largest triangle three buckets, NaN points are
+    dropped; x can be numbers or datetimes"""
+    if pd.api.types.is_datetime64_any_dtype(x):
+        # also timezone aware, the triangle areas only need the distances between the points
+        x = pd.DatetimeIndex(x).asi8
+    x = np.asarray(x, dtype="float64")
+    y = np.asarray(y, dtype="float64")
+    valid = np.flatnonzero(~np.isnan(y))
+    n = len(valid)
+    if n <= n_out or n_out < 3:
+        return valid
+    x, y = x[valid], y[valid]
+
+    # the first and last points are always kept, the others are split into n_out - 2 buckets
+    edges = np.linspace(1, n - 1, n_out - 1).astype("int64")
+    selected = np.empty(n_out, dtype="int64")
+    selected[0], selected[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        # the third corner is the average of the next bucket
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean()
+        area = np.abs((x[a] - avg_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (avg_y - y[a]))
+        a = start + area.argmax()
+        selected[i + 1] = a
+    return valid[selected]
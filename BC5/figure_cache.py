@@ -0,0 +1,67 @@
+import json
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+
+import metrics
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Serialized figure cache
+#
+# Keeps the figures of the technical analysis as the JSON plotly would send, keyed by (coin, range, indicator) and the
+# version of the bars they were built from. A hit is decoded into plain dicts, which dash sends without building and
+# validating go.Figure objects again. Entries are evicted least recently used first once their total size passes
+# max_bytes; a new version of a key replaces the old one.
+
+
+class FigureCache:
+    """LRU of serialized figures with a memory cap"""
+
+    def __init__(self, max_bytes=256 * 2 ** 20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        # key -> (version, [figure json, ...], size)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, version):
+        """returns the figures of key as dicts if they were built from this version of the bars, otherwise None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                self.misses += 1
+                metrics.cache_result("figures", "miss")
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        metrics.cache_result("figures", "hit")
+        return [json.loads(figure) for figure in entry[1]]
+
+    def put(self, key, version, figures):
+        """stores go.Figure objects or figure dicts"""
+        self.put_json(key, version, [pio.to_json(figure, validate=False) for figure in figures])
+
+    def put_json(self, key, version, serialized):
+        """stores figures that were already serialized (by pio.to_json / Figure.to_json)"""
+        serialized = [figure.encode() if isinstance(figure, str) else figure for figure in serialized]
+        size = sum(len(figure) for figure in serialized)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key)[2]
+            self._entries[key] = (version, serialized, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                self.nbytes -= self._entries.popitem(last=False)[1][2]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
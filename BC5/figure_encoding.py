@@ -0,0 +1,95 @@
+import base64
+
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Compact encoding of the figure data
+#
+# Plotly sends the data arrays of a figure as JSON lists: every price is a 17 digit decimal and every date an ISO
+# string. plotly.js also reads typed arrays given as {"dtype": ..., "bdata": <base64>}, so the numeric arrays are sent
+# as float32 when that keeps the values to within RTOL (prices and volumes do) and the dates as float64 milliseconds
+# since the epoch, which a date axis shows as the same wall time.
+
+# trace attributes holding one value per point
+ARRAYS = ["x", "y", "open", "high", "low", "close", "values"]
+# largest relative error accepted for float32
+RTOL = 1e-6
+
+
+def typed_array(values):
+    """returns values (numbers or datetimes) as a plotly typed array, None if they are neither"""
+    values = _dates(values)
+    if isinstance(values, pd.DatetimeIndex):
+        # the wall time the ISO strings showed, as if it was UTC
+        if values.tz is not None:
+            values = values.tz_localize(None)
+        epoch_ms = values.asi8 / _per_ms(values)
+        return _encode(np.asarray(epoch_ms, dtype="float64"), "f8")
+    values = np.asarray(values)
+    if values.dtype.kind not in "iuf":
+        return None
+    values = values.astype("float64", copy=False)
+    single = values.astype("float32")
+    finite = np.isfinite(values)
+    if np.all(np.isfinite(single[finite])) and np.allclose(single[finite], values[finite], rtol=RTOL, atol=0):
+        return _encode(single, "f4")
+    return _encode(values, "f8")
+
+
+def _dates(values):
+    """returns values as a DatetimeIndex if they are dates (datetime64 or Timestamp objects), otherwise unchanged"""
+    if isinstance(values, pd.DatetimeIndex):
+        return values
+    if isinstance(values, (pd.Series, pd.Index, np.ndarray)) and values.dtype.kind == "M":
+        return pd.DatetimeIndex(values)
+    if isinstance(values, (pd.Series, pd.Index, np.ndarray)) and values.dtype == object and len(values) > 0 \
+            and isinstance(values[0], (pd.Timestamp, np.datetime64)):
+        return pd.DatetimeIndex(values)
+    return values
+
+
+def _per_ms(dates):
+    """returns the number of index units (asi8) in a millisecond"""
+    return pd.Timedelta(milliseconds=1) // pd.Timedelta(1, unit=np.datetime_data(dates.dtype)[0])
+
+
+def _encode(values, dtype):
+    return {"dtype": dtype, "bdata": base64.b64encode(np.ascontiguousarray(values).tobytes()).decode("ascii")}
+
+
+def _decode(array):
+    """returns the values of a typed array"""
+    return np.frombuffer(base64.b64decode(array["bdata"]), dtype=array["dtype"])
+
+
+def compact_figure(figure):
+    """returns the figure (go.Figure or dict) as a dict with its data arrays typed, ready to be sent"""
+    figure = figure.to_plotly_json() if hasattr(figure, "to_plotly_json") else dict(figure)
+    layout = dict(figure.get("layout", {}))
+    traces = []
+    for trace in figure.get("data", []):
+        trace = dict(trace)
+        for name in ARRAYS:
+            values = trace.get(name)
+            # empty arrays stay lists, the live traces are extended in the browser (stream.py)
+            if values is None or len(values) == 0:
+                continue
+            # newer plotly versions already type the numbers, as float64
+            if isinstance(values, dict):
+                if "bdata" not in values or values.get("shape") is not None:
+                    continue
+                values = _decode(values)
+            values = _dates(values)
+            encoded = typed_array(values)
+            if encoded is None:
+                continue
+            trace[name] = encoded
+            if name == "x" and isinstance(values, pd.DatetimeIndex):
+                # numbers on a date axis are milliseconds since the epoch, the axis type can no longer be guessed
+                axis = "xaxis" + trace.get("xaxis", "x")[1:]
+                layout[axis] = dict(layout.get(axis, {}), type="date")
+        traces.append(trace)
+    figure["data"] = traces
+    figure["layout"] = layout
+    return figure
@@ -0,0 +1,237 @@
+import os
+import pickle
+
+import numpy as np
+from math import ceil
+from numpy.lib.stride_tricks import sliding_window_view
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Price forecast
+#
+# Kept apart from app.py so the prediction scheduler can run it in worker processes: importing this module does not
+# download anything and tensorflow / scikit-learn are only imported once a model is actually needed.
+#
+# The model behind the predictions is pluggable (FORECASTERS). The default ridge regression on the lagged windows
+# trains in milliseconds; the original stacked LSTM is still available as "lstm" and is the only backend importing
+# tensorflow.
+#
+# In batched mode (predict_batch) one model is trained on the windows of every coin at once, each coin min-max scaled
+# on its own, and all coins are predicted with a single predict call, so a refresh of the whole universe costs one fit
+# instead of one per coin.
+
+# registry entry of the model shared by all coins
+UNIVERSE = "_universe"
+
+_registries = {}
+
+
+def get_registry(backend="ridge"):
+    """returns the model registry of the backend in the current process"""
+    if backend not in _registries:
+        from model_registry import ModelRegistry
+        _registries[backend] = ModelRegistry(FORECASTERS[backend], directory=os.path.join("models", backend),
+                                             max_models=8)
+    return _registries[backend]
+
+
+class Forecaster:
+    """interface of the prediction backends: fit on the scaled windows, predict the scaled next values"""
+
+    def fit(self, X_train, y_train):
+        raise NotImplementedError
+
+    def predict(self, X):
+        """returns one scaled prediction per window of X (shape (windows, prediction_days))"""
+        raise NotImplementedError
+
+    def save(self, path):
+        with open(os.path.join(path, "forecaster.pkl"), "wb") as file:
+            pickle.dump(self, file)
+
+    @classmethod
+    def load(cls, path):
+        with open(os.path.join(path, "forecaster.pkl"), "rb") as file:
+            return pickle.load(file)
+
+
+class RidgeForecaster(Forecaster):
+    """ridge regression of the next scaled close on the previous prediction_days scaled closes"""
+
+    def __init__(self, alpha=0.1):
+        self.alpha = alpha
+        self.model = None
+
+    def fit(self, X_train, y_train):
+        from sklearn.linear_model import Ridge
+        self.model = Ridge(alpha=self.alpha).fit(X_train, y_train)
+        return self
+
+    def predict(self, X):
+        return self.model.predict(X)
+
+
+class LSTMForecaster(Forecaster):
+    """the original three layer LSTM, trained for one epoch"""
+
+    def __init__(self):
+        self.model = None
+
+    def fit(self, X_train, y_train):
+        import tensorflow as tf
+
+        tf.random.set_seed(12)
+        X_train = np.reshape(X_train, (X_train.shape[0], X_train.shape[1], 1))
+
+        # Building and training the model
+        model = tf.keras.models.Sequential()
+        model.add(tf.keras.layers.LSTM(units=50, return_sequences=True, input_shape=(X_train.shape[1], 1)))
+        # Prevent overfitting
+        model.add(tf.keras.layers.Dropout(0.2))
+
+        model.add(tf.keras.layers.LSTM(units=50, return_sequences=True))
+
+        model.add(tf.keras.layers.Dropout(0.2))
+
+        model.add(tf.keras.layers.LSTM(units=50))
+
+        model.add(tf.keras.layers.Dropout(0.2))
+
+        model.add(tf.keras.layers.Dense(units=1))
+
+        model.compile(optimizer='adam', loss='mse')
+        model.fit(X_train, y_train, epochs=1)
+        self.model = model
+        return self
+
+    def predict(self, X):
+        X = np.reshape(X, (X.shape[0], X.shape[1], 1))
+        return self.model.predict(X).reshape(-1)
+
+    def save(self, path):
+        # keras 3 only saves to a .keras (or .h5) file
+        self.model.save(os.path.join(path, "model.keras"))
+
+    @classmethod
+    def load(cls, path):
+        import tensorflow as tf
+        forecaster = cls()
+        forecaster.model = tf.keras.models.load_model(os.path.join(path, "model.keras"))
+        return forecaster
+
+
+FORECASTERS = {"ridge": RidgeForecaster, "lstm": LSTMForecaster}
+
+
+def prediction_windows(n_days):
+    """returns (testing_days, prediction_days, future_day) for a series of n_days closes"""
+    # how many days to use for testing
+    testing_days = ceil(n_days * 0.2)
+    # how many days to go back for predicting one value
+    prediction_days = ceil(ceil(n_days * 0.8) * 0.05)
+    # how many days in the future to predict from the day after the last date (zero means it predicts the day after)
+    future_day = 1
+    return testing_days, prediction_days, future_day
+
+
+def training_windows(scaled, prediction_days, future_day):
+    """returns (X, y): the prediction_days long windows of the last axis of scaled and the value future_day after each
+
+    scaled may hold one series (days,) or one per coin (coins, days); X is a read only view on it with shape
+    (..., windows, prediction_days) and y has shape (..., windows)"""
+    n_days = scaled.shape[-1]
+    windows = sliding_window_view(scaled, prediction_days, axis=-1)
+    # window i covers the days i .. i + prediction_days - 1, its target is day i + prediction_days + future_day
+    X = windows[..., :n_days - prediction_days - future_day, :]
+    y = scaled[..., prediction_days + future_day:]
+    return X, y
+
+
+def last_windows(scaled, prediction_days, count):
+    """returns a view on the last count complete windows before the last day of scaled, shape (..., count,
+    prediction_days), the last one ending on the day before the last"""
+    inputs = scaled[..., scaled.shape[-1] - prediction_days - count:]
+    return sliding_window_view(inputs, prediction_days, axis=-1)[..., :count, :]
+
+
+def train(closes, backend="ridge"):
+    """fits the scaler and the backend's model on the closing prices, returns (model, scaler)"""
+    from sklearn.preprocessing import MinMaxScaler
+
+    # scaling for better model performance
+    scaler = MinMaxScaler()
+    scaled = scaler.fit_transform(closes.reshape(-1, 1))
+
+    testing_days, prediction_days, future_day = prediction_windows(len(scaled))
+
+    X, y = training_windows(scaled[:, 0], prediction_days, future_day)
+    X_train = X[:-testing_days]
+    y_train = y[:-testing_days]
+
+    model = FORECASTERS[backend]().fit(X_train, y_train)
+    return model, scaler
+
+
+def predict_prices(coin, df, backend="ridge"):
+    """returns the predicted (tomorrow, day after tomorrow) prices from the last closes of the coin"""
+    registry = get_registry(backend)
+
+    # the model is only trained the first time these closes are seen, afterwards it comes from the registry
+    model, scaler = registry.get_or_train(coin, df.values.reshape(-1), lambda closes: train(closes, backend))
+    scaled = scaler.transform(df.values.reshape(-1, 1))
+
+    testing_days, prediction_days, future_day = prediction_windows(len(scaled))
+
+    # building test data with same logic as train data, but for the last testing_days windows
+    X_test = last_windows(scaled[:, 0], prediction_days, testing_days)
+
+    predicted_prices_sc = model.predict(X_test)
+    # again prices in dollars
+    predicted_prices = scaler.inverse_transform(predicted_prices_sc.reshape(-1, 1))[:, 0]
+
+    # the dashboard shows the predictions of the last two windows as tomorrow's and the day after's price
+    price_tmr = np.round(predicted_prices[-2], 4)
+    price_tmr2 = np.round(predicted_prices[-1], 4)
+
+    return price_tmr, price_tmr2
+
+
+def scale_rows(closes):
+    """min-max scales every row of closes (coins, days) on its own, returns (scaled, (low, span))"""
+    low = closes.min(axis=1, keepdims=True)
+    span = closes.max(axis=1, keepdims=True) - low
+    # a constant series stays at zero instead of dividing by zero
+    span[span == 0] = 1.0
+    return (closes - low) / span, (low, span)
+
+
+def train_batch(closes, backend="ridge"):
+    """fits one model on the stacked windows of every coin of closes (coins, days), returns (model, (low, span))"""
+    scaled, scaler = scale_rows(closes)
+
+    testing_days, prediction_days, future_day = prediction_windows(closes.shape[1])
+
+    X, y = training_windows(scaled, prediction_days, future_day)
+    X_train = X[:, :-testing_days].reshape(-1, prediction_days)
+    y_train = y[:, :-testing_days].reshape(-1)
+
+    model = FORECASTERS[backend]().fit(X_train, y_train)
+    return model, scaler
+
+
+def predict_batch(coins, closes, backend="ridge"):
+    """returns {coin: (tomorrow, day after tomorrow)} from the closes frame (one column per coin, no missing values)"""
+    values = np.ascontiguousarray(closes[coins].to_numpy(dtype="float64").T)
+    registry = get_registry(backend)
+
+    # trained once per new daily bar for the whole universe
+    model, (low, span) = registry.get_or_train(UNIVERSE, values, lambda values: train_batch(values, backend))
+    scaled = (values - low) / span
+
+    testing_days, prediction_days, future_day = prediction_windows(values.shape[1])
+
+    # the same two windows predict_prices() reads its prices from, for every coin in one call
+    X_test = last_windows(scaled, prediction_days, 2).reshape(-1, prediction_days)
+    predicted_prices = model.predict(X_test).reshape(len(coins), 2) * span + low
+    predicted_prices = np.round(predicted_prices, 4)
+
+    return {coin: (predicted_prices[i, 0], predicted_prices[i, 1]) for i, coin in enumerate(coins)}
@@ -0,0 +1,223 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import metrics
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Incremental technical indicators
+#
+# Computes the columns plot_technical_analyis() draws (Bollinger sma/std, the two SMA or EMA lines, Signal and
+# Position) with the same definitions as the pandas rolling/ewm calls, missing closes included, but keeps the state of
+# every series: running sums of the closes, of their squares and of the number of valid closes for the rolling windows
+# (NaN closes count as missing, like pandas does) and the value and weight of each EMA.
+#
+# A series is identified by coin, interval, first bar and parameters, so the indicators of a range are computed over
+# its own bars exactly as pandas does. A series that grew by a few bars only computes the new ones, each in O(1), and
+# the same bars (or the first of them) are answered from memory, sliced out of the kept arrays. Bars that do not line
+# up with the kept ones rebuild the series, a range whose first bar moved forward is a new series.
+
+
+class _State:
+    """indicator arrays of one series, with spare capacity so appending does not copy"""
+
+    ARRAYS = ["close", "cumsum", "cumsq", "count", "short", "short_weight", "long", "long_weight", "sma", "std"]
+
+    def __init__(self, close, params):
+        self.params = params
+        self.n = 0
+        self.index = close.index
+        capacity = max(16, 2 * len(close))
+        for name in self.ARRAYS:
+            setattr(self, name, np.empty(capacity))
+        # (first timestamp, length) -> frame of the slices already asked for
+        self.frames = {}
+
+    def reserve(self, size):
+        if size <= len(self.close):
+            return
+        capacity = 2 * size
+        for name in self.ARRAYS:
+            array = np.empty(capacity)
+            array[:self.n] = getattr(self, name)[:self.n]
+            setattr(self, name, array)
+
+
+def _same(a, b):
+    return a == b or (a != a and b != b)
+
+
+class IndicatorEngine:
+    """LRU of indicator states keyed by (coin, interval, first bar, windows, indicator)"""
+
+    def __init__(self, max_series=64):
+        self.max_series = max_series
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def compute(self, coin, interval, close, short_window, long_window, boll_window, indicator="EMA"):
+        """returns a frame indexed like close with the sma, std, <window>_<indicator>, Signal and Position columns"""
+        if len(close) == 0:
+            return _frame(close.index, np.empty(0), np.empty(0), np.empty(0), np.empty(0), short_window, long_window,
+                          indicator)
+        params = (short_window, long_window, boll_window, indicator)
+        key = (coin, interval, close.index[0]) + params
+        values = close.to_numpy(dtype="float64")
+
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            position = _position(state, close)
+            if position is None:
+                state = _State(close, params)
+                self._states[key] = state
+                while len(self._states) > self.max_series:
+                    self._states.popitem(last=False)
+                _compute_all(state, values)
+                position = 0
+                metrics.cache_result("indicators", "miss")
+            else:
+                # kept bars in close: close[:overlap] are state[position:state.n]
+                overlap = min(state.n - position, len(values))
+                if len(values) <= overlap and _same(values[-1], state.close[position + len(values) - 1]):
+                    metrics.cache_result("indicators", "hit")
+                else:
+                    metrics.cache_result("indicators", "partial")
+                    # the last kept bar may have been incomplete, it is recomputed with the new ones
+                    start = overlap if _same(values[overlap - 1], state.close[position + overlap - 1]) else overlap - 1
+                    state.index = state.index[:position].append(close.index)
+                    _append(state, values[start:], position + start)
+
+            slice_key = (close.index[0], len(values))
+            frame = state.frames.get(slice_key)
+            if frame is None:
+                rows = slice(position, position + len(values))
+                frame = _frame(close.index, state.sma[rows], state.std[rows], state.short[rows], state.long[rows],
+                               short_window, long_window, indicator)
+                state.frames[slice_key] = frame
+            return frame
+
+
+def _position(state, close):
+    """returns where close starts in the kept bars if its bars line up with them, otherwise None"""
+    if state is None or state.n == 0:
+        return None
+    position = state.index.searchsorted(close.index[0])
+    if position >= state.n or state.index[position] != close.index[0]:
+        return None
+    overlap = min(state.n - position, len(close))
+    if close.index[overlap - 1] != state.index[position + overlap - 1]:
+        return None
+    # an older version of a bar before the last kept one: the kept values are no longer those of these bars
+    if overlap > 1 and not _same(close.iloc[overlap - 2], state.close[position + overlap - 2]):
+        return None
+    return position
+
+
+def _windows(state, start, end, window):
+    """running sums over the window ending at each bar start:end: (sum of the valid closes, of their squares, their
+    number)"""
+    rows = np.arange(start, end)
+    before = rows - window
+    valid = before >= 0
+    before = np.maximum(before, 0)
+    total = state.cumsum[rows] - np.where(valid, state.cumsum[before], 0.0)
+    squares = state.cumsq[rows] - np.where(valid, state.cumsq[before], 0.0)
+    count = state.count[rows] - np.where(valid, state.count[before], 0.0)
+    return total, squares, count
+
+
+def _ewm_weights(values, alpha):
+    """weight of the previous EMA value after each bar, as pandas ewm(adjust=False) keeps it: 1 after a close, decayed
+    by 1 - alpha for every missing close since"""
+    rows = np.arange(len(values))
+    last = np.maximum.accumulate(np.where(~np.isnan(values), rows, -1))
+    return np.where(last >= 0, (1 - alpha) ** (rows - last), 1.0)
+
+
+def _compute_all(state, values):
+    short_window, long_window, boll_window, indicator = state.params
+    n = len(values)
+    state.reserve(n)
+    valid = ~np.isnan(values)
+    state.close[:n] = values
+    state.cumsum[:n] = np.cumsum(np.where(valid, values, 0.0))
+    state.cumsq[:n] = np.cumsum(np.where(valid, values * values, 0.0))
+    state.count[:n] = np.cumsum(valid)
+    close = pd.Series(values)
+    for window, out, weight in [(short_window, state.short, state.short_weight),
+                                (long_window, state.long, state.long_weight)]:
+        if indicator == "SMA":
+            out[:n] = close.rolling(window = window, min_periods = 1).mean().to_numpy()
+        else:
+            out[:n] = close.ewm(span = window, adjust = False).mean().to_numpy()
+            weight[:n] = _ewm_weights(values, 2 / (window + 1))
+    _bollinger(state, 0, n, boll_window)
+    state.n = n
+
+
+def _append(state, values, start):
+    """sets the bars from position start to values, each in constant time"""
+    short_window, long_window, boll_window, indicator = state.params
+    end = start + len(values)
+    state.reserve(end)
+    for t, x in zip(range(start, end), values):
+        valid = x == x
+        state.close[t] = x
+        previous = (state.cumsum[t - 1], state.cumsq[t - 1], state.count[t - 1]) if t > 0 else (0.0, 0.0, 0.0)
+        state.cumsum[t] = previous[0] + (x if valid else 0.0)
+        state.cumsq[t] = previous[1] + (x * x if valid else 0.0)
+        state.count[t] = previous[2] + valid
+        for window, out, weight in [(short_window, state.short, state.short_weight),
+                                    (long_window, state.long, state.long_weight)]:
+            if indicator == "SMA":
+                # min_periods = 1: the mean of the valid closes in the window, NaN if there is none
+                total, _, count = _windows(state, t, t + 1, window)
+                out[t] = total[0] / count[0] if count[0] > 0 else np.nan
+            elif t == 0 or out[t - 1] != out[t - 1]:
+                # no close yet: the EMA starts at the first one
+                out[t], weight[t] = x, 1.0
+            else:
+                # ewm(adjust=False, ignore_na=False): a missing close keeps the value and decays its weight
+                alpha = 2 / (window + 1)
+                decayed = weight[t - 1] * (1 - alpha)
+                if valid:
+                    out[t] = (decayed * out[t - 1] + alpha * x) / (decayed + alpha)
+                    weight[t] = 1.0
+                else:
+                    out[t], weight[t] = out[t - 1], decayed
+    _bollinger(state, start, end, boll_window)
+    state.n = end
+    state.frames = {}
+
+
+def _bollinger(state, start, end, window):
+    """rolling mean and population std of the bars start:end from the running sums, NaN unless the window holds window
+    valid closes (the pandas min_periods)"""
+    if start >= end:
+        return
+    total, squares, count = _windows(state, start, end, window)
+    full = count >= window
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = total / count
+        state.sma[start:end] = np.where(full, mean, np.nan)
+        state.std[start:end] = np.where(full, np.sqrt(np.maximum(squares / count - mean * mean, 0.0)), np.nan)
+
+
+def _frame(index, sma, std, short, long, short_window, long_window, indicator):
+    # create a new column 'Signal' such that if faster moving average is greater than slower moving average
+    # then set Signal as 1 else 0.
+    signal = np.where(short > long, 1.0, 0.0)
+    # 'Position' is the day-to-day difference of the 'Signal' column.
+    position = np.concatenate([[np.nan], np.diff(signal)]) if len(signal) > 0 else signal
+    return pd.DataFrame({
+        "sma": sma,
+        "std": std,
+        str(short_window) + '_' + indicator: short,
+        str(long_window) + '_' + indicator: long,
+        "Signal": signal,
+        "Position": position,
+    }, index=index)
@@ -0,0 +1,212 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, \
+    generate_latest
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Instrumentation
+#
+# Where the time of a request goes, exposed in the Prometheus text format on /metrics of the flask server:
+#   bc5_callback_seconds{callback, status}       a whole dash callback request, JSON serialization of the figures
+#                                                included (measured around the flask request)
+#   bc5_callback_response_bytes{callback}        size of the callback responses
+#   bc5_stage_seconds{function, stage}           the stages of create_leaderboard(), plot_technical_analyis(),
+#                                                prediction(), the figure building and the model fits; "total" is the
+#                                                whole function
+#   bc5_cache_requests_total{cache, result}      hits and misses of the in-process caches (stale: served while it is
+#                                                refreshed, partial: only the new bars computed)
+#   bc5_upstream_seconds{host, outcome}          every request to yahoo and binance, outcome is the http status or the
+#                                                error
+#   bc5_upstream_retries_total{host}
+#
+# With SLOW_CALLBACK_MS set, every callback slower than that is logged with its inputs and the stages it went through.
+# Metrics are kept per process; when the app runs in several processes (gunicorn workers) and PROMETHEUS_MULTIPROC_DIR
+# is set, prometheus_client writes them to that directory and /metrics adds up every process. The processes forked by
+# the app for the dash background callbacks (prediction()) exit after a single callback: with forward_forked() they
+# send their measures to a disk queue that the app records when /metrics is rendered.
+
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+UPSTREAM_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+CALLBACK_PATH = "/_dash-update-component"
+
+CALLBACK_SECONDS = Histogram("bc5_callback_seconds", "dash callback requests", ["callback", "status"],
+                             buckets=STAGE_BUCKETS)
+CALLBACK_BYTES = Histogram("bc5_callback_response_bytes", "size of the dash callback responses", ["callback"],
+                           buckets=(1e3, 1e4, 3e4, 1e5, 3e5, 1e6, 3e6))
+STAGE_SECONDS = Histogram("bc5_stage_seconds", "stages of the dashboard functions", ["function", "stage"],
+                          buckets=STAGE_BUCKETS)
+CACHE_REQUESTS = Counter("bc5_cache_requests", "cache lookups", ["cache", "result"])
+UPSTREAM_SECONDS = Histogram("bc5_upstream_seconds", "requests to yahoo and binance", ["host", "outcome"],
+                             buckets=UPSTREAM_BUCKETS)
+UPSTREAM_RETRIES = Counter("bc5_upstream_retries", "requests to yahoo and binance tried again", ["host"])
+
+# name of the measures sent by a forked process -> metric
+FORWARDED = {"stage": STAGE_SECONDS, "cache": CACHE_REQUESTS, "upstream": UPSTREAM_SECONDS,
+             "retry": UPSTREAM_RETRIES}
+
+# the stages of the callback request running in this thread, for the slow callback log
+_request = threading.local()
+# directory of the disk queue of the forked processes (forward_forked), the queue read by this process and the one a
+# forked process writes to
+_forward_directory = None
+_forwarded = None
+_forward = None
+
+
+def forward_forked(directory):
+    """sends the measures of the processes forked from this one from now on to a disk queue in directory, they are
+    recorded here when the metrics are rendered"""
+    global _forward_directory, _forwarded
+    import diskcache
+
+    _forward_directory = directory
+    _forwarded = diskcache.Deque(directory=directory)
+    # measures of a previous run
+    _forwarded.clear()
+
+
+def _after_fork():
+    global _forward
+    # a connection of its own, the one of the parent must not be used from two processes
+    if _forward_directory is not None:
+        import diskcache
+
+        _forward = diskcache.Deque(directory=_forward_directory)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+def _record(name, labels, value):
+    if _forward is not None:
+        _forward.append((name, labels, value))
+        return
+    metric = FORWARDED[name].labels(*labels)
+    if isinstance(metric, Histogram):
+        metric.observe(value)
+    else:
+        metric.inc(value)
+
+
+def _record_forwarded():
+    """records the measures the forked processes sent so far"""
+    if _forwarded is None:
+        return
+    while True:
+        try:
+            name, labels, value = _forwarded.popleft()
+        except IndexError:
+            return
+        _record(name, labels, value)
+
+
+def observe_stage(function, stage, seconds):
+    _record("stage", (function, stage), seconds)
+    stages = getattr(_request, "stages", None)
+    if stages is not None:
+        stages.append((f"{function}.{stage}", round(seconds * 1000, 1)))
+
+
+@contextmanager
+def stage(function, name):
+    """times the block as a stage of function"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(function, name, time.perf_counter() - start)
+
+
+class Stopwatch:
+    """times consecutive stages of function: lap(stage) ends the stage that ran since the previous lap"""
+
+    def __init__(self, function):
+        self.function = function
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        observe_stage(self.function, stage, now - self._last)
+        self._last = now
+
+
+def timed(function):
+    """decorator timing every call as the "total" stage of the function"""
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(function.__name__, "total"):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def cache_result(cache, result):
+    """counts a lookup of cache, result is hit, miss, stale or partial"""
+    _record("cache", (cache, result), 1)
+
+
+def observe_upstream(host, outcome, seconds):
+    _record("upstream", (host, str(outcome)), seconds)
+
+
+def upstream_retry(host):
+    _record("retry", (host,), 1)
+
+
+def callback_inputs(body):
+    """returns {"id.property": value} of the inputs and states of a dash callback request body"""
+    return {f"{item['id']}.{item['property']}": item.get("value")
+            for item in body.get("inputs", []) + body.get("state", []) if isinstance(item, dict)}
+
+
+def render():
+    """returns the metrics of this process (of every process in multiprocess mode) in the text format"""
+    _record_forwarded()
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        from prometheus_client import multiprocess
+
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry)
+    return generate_latest(REGISTRY)
+
+
+def instrument(server, slow_ms=None):
+    """adds the /metrics route to the flask server and times its dash callback requests, logging the ones slower than
+    slow_ms milliseconds"""
+    from flask import Response, g, request
+
+    @server.route("/metrics")
+    def metrics():
+        return Response(render(), content_type=CONTENT_TYPE_LATEST)
+
+    @server.before_request
+    def start_timer():
+        if request.path.endswith(CALLBACK_PATH):
+            g.callback_start = time.perf_counter()
+            _request.stages = []
+
+    @server.after_request
+    def stop_timer(response):
+        start = g.pop("callback_start", None)
+        if start is None:
+            return response
+        seconds = time.perf_counter() - start
+        stages, _request.stages = _request.stages, None
+        body = request.get_json(silent=True) or {}
+        callback = body.get("output", "unknown")
+        CALLBACK_SECONDS.labels(callback, response.status_code).observe(seconds)
+        if response.content_length is not None:
+            CALLBACK_BYTES.labels(callback).observe(response.content_length)
+
+        if slow_ms is not None and seconds * 1000 >= slow_ms:
+            print("slow callback: " + json.dumps({"callback": callback, "ms": round(seconds * 1000, 1),
+                                                  "status": response.status_code, "inputs": callback_inputs(body),
+                                                  "stages": stages}, default=str))
+        return response
@@ -0,0 +1,108 @@
+import hashlib
+import os
+import pickle
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Registry of the trained prediction models
+#
+# A model is identified by the coin and a fingerprint of the closing prices it was trained on, so as long as no new
+# daily bar arrives for a coin the dashboard only runs inference. The most recently used models are kept in memory,
+# every model is also written to disk (the forecaster's own format + fitted scaler) so a restarted server does not have
+# to retrain.
+
+
+def fingerprint(closes):
+    """returns a short hash identifying the closing prices a model was trained on"""
+    values = np.ascontiguousarray(np.asarray(closes, dtype="float64"))
+    return hashlib.sha1(values.tobytes()).hexdigest()[:16]
+
+
+class ModelRegistry:
+    """LRU cache of (model, scaler) pairs keyed by coin and fingerprint, backed by an on-disk store"""
+
+    def __init__(self, forecaster_class, directory="models", max_models=8):
+        # forecaster_class.load(path) reads back what model.save(path) wrote
+        self.forecaster_class = forecaster_class
+        self.directory = directory
+        self.max_models = max_models
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._training = {}
+
+    def _path(self, coin, key):
+        return os.path.join(self.directory, coin, key)
+
+    def _remember(self, coin, key, entry):
+        with self._lock:
+            self._models[(coin, key)] = entry
+            self._models.move_to_end((coin, key))
+            while len(self._models) > self.max_models:
+                self._models.popitem(last=False)
+
+    def get(self, coin, closes):
+        """returns the stored (model, scaler) for the coin and closes or None if it was never trained"""
+        key = fingerprint(closes)
+        with self._lock:
+            if (coin, key) in self._models:
+                self._models.move_to_end((coin, key))
+                return self._models[(coin, key)]
+
+        path = self._path(coin, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            model = self.forecaster_class.load(path)
+            with open(os.path.join(path, "scaler.pkl"), "rb") as file:
+                scaler = pickle.load(file)
+        except (OSError, IOError, ValueError, pickle.UnpicklingError):
+            # half written or incompatible entry, it will be retrained
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        self._remember(coin, key, (model, scaler))
+        return model, scaler
+
+    def put(self, coin, closes, model, scaler):
+        """stores a freshly trained model, dropping the older models of the same coin from disk"""
+        key = fingerprint(closes)
+        self._remember(coin, key, (model, scaler))
+
+        coin_dir = os.path.join(self.directory, coin)
+        if os.path.isdir(coin_dir):
+            for old_key in os.listdir(coin_dir):
+                if old_key != key:
+                    shutil.rmtree(os.path.join(coin_dir, old_key), ignore_errors=True)
+
+        path = self._path(coin, key)
+        tmp_path = path + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        model.save(tmp_path)
+        with open(os.path.join(tmp_path, "scaler.pkl"), "wb") as file:
+            pickle.dump(scaler, file)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    def get_or_train(self, coin, closes, train):
+        """returns the (model, scaler) for the closes, calling train(closes) only once even for concurrent callers"""
+        entry = self.get(coin, closes)
+        if entry is not None:
+            return entry
+
+        key = fingerprint(closes)
+        with self._lock:
+            lock = self._training.setdefault((coin, key), threading.Lock())
+        with lock:
+            # another request may have trained it while we were waiting
+            entry = self.get(coin, closes)
+            if entry is None:
+                model, scaler = train(closes)
+                self.put(coin, closes, model, scaler)
+                entry = (model, scaler)
+        with self._lock:
+            self._training.pop((coin, key), None)
+        return entry
@@ -0,0 +1,167 @@
+import json
+import os
+import sys
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from pyarrow import fs
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Local OHLCV store
+#
+# One parquet dataset per coin and bar interval, partitioned by year: store/BTC-USD/1d/year=2022/part.parquet. Reads go
+# through a memory mapped filesystem, only load the requested columns and push the date range down to the partitions
+# and the row group statistics, so loading the last month of a coin does not touch the older years.
+
+FIELDS = ["Open", "High", "Low", "Close", "Adj Close", "Volume"]
+INTRADAY = ["15m", "60m"]
+
+
+class OHLCVStore:
+    """parquet datasets of OHLCV bars, one per (coin, interval)"""
+
+    def __init__(self, directory="store"):
+        self.directory = directory
+        self.filesystem = fs.LocalFileSystem(use_mmap=True)
+        self._lock = threading.Lock()
+
+    def _path(self, coin, interval):
+        return os.path.join(self.directory, coin, interval)
+
+    def coverage(self, coin, interval):
+        """returns the date from which the stored bars are complete up to the last one ("max" for the whole history)"""
+        path = os.path.join(self._path(coin, interval), "_coverage.json")
+        if not os.path.exists(path):
+            return None
+        with open(path) as file:
+            covered_from = json.load(file)["covered_from"]
+        return covered_from if covered_from == "max" else pd.Timestamp(covered_from)
+
+    def covers(self, coin, interval, start):
+        """True if every bar since start (None for the whole history) is stored"""
+        covered_from = self.coverage(coin, interval)
+        if covered_from is None or covered_from == "max":
+            return covered_from == "max"
+        return start is not None and covered_from <= to_utc(start)
+
+    def write(self, coin, interval, data, covered_from=None):
+        """merges the bars of data (indexed by date, columns from FIELDS) into the dataset, new rows win
+
+        covered_from is the start of the period data was downloaded for ("max" for the whole history), leave it None for
+        bars appended after the last stored one"""
+        data = data[[field for field in FIELDS if field in data.columns]].dropna(how="all")
+        # a failed download comes as NaN only, it must not mark the period as covered
+        if len(data) == 0:
+            return
+        data = data.rename_axis("Date")
+        path = self._path(coin, interval)
+        with self._lock:
+            if covered_from is not None:
+                self._update_coverage(coin, interval, covered_from)
+            for year, bars in data.groupby(data.index.year):
+                year_dir = os.path.join(path, f"year={year}")
+                file = os.path.join(year_dir, "part.parquet")
+                if os.path.exists(file):
+                    stored = pq.read_table(file, memory_map=True).to_pandas().set_index("Date")
+                    bars = pd.concat([stored, bars])
+                    bars = bars[~bars.index.duplicated(keep="last")]
+                bars = bars.sort_index()
+                os.makedirs(year_dir, exist_ok=True)
+                pq.write_table(pa.Table.from_pandas(bars.reset_index(), preserve_index=False), file + ".tmp")
+                os.replace(file + ".tmp", file)
+
+    def _update_coverage(self, coin, interval, covered_from):
+        previous = self.coverage(coin, interval)
+        last = self.last_timestamp(coin, interval)
+        if covered_from != "max":
+            covered_from = to_utc(covered_from)
+            # the new block only extends the stored one if they overlap
+            if previous is not None and last is not None and to_utc(last) >= covered_from:
+                covered_from = previous if previous == "max" else min(previous, covered_from)
+            covered_from = covered_from if covered_from == "max" else covered_from.isoformat()
+        os.makedirs(self._path(coin, interval), exist_ok=True)
+        with open(os.path.join(self._path(coin, interval), "_coverage.json"), "w") as file:
+            json.dump({"covered_from": covered_from}, file)
+
+    def read(self, coin, interval, start=None, end=None, columns=None):
+        """returns the bars between start and end (inclusive, None for open ended) with only the given columns
+
+        returns None when nothing is stored for the coin and interval (also when its directory has no bars)"""
+        path = self._path(coin, interval)
+        if not os.path.isdir(path):
+            return None
+        dataset = ds.dataset(path, format="parquet", partitioning="hive", filesystem=self.filesystem)
+        if "Date" not in dataset.schema.names:
+            return None
+        date_type = dataset.schema.field("Date").type
+
+        condition = None
+        for bound, compare in [(start, "ge"), (end, "le")]:
+            if bound is None:
+                continue
+            bound = _timestamp(bound, date_type)
+            # whole years outside the range are skipped without opening their files
+            year = ds.field("year") >= bound.year if compare == "ge" else ds.field("year") <= bound.year
+            date = ds.field("Date") >= pa.scalar(bound, date_type) if compare == "ge" else \
+                ds.field("Date") <= pa.scalar(bound, date_type)
+            condition = year & date if condition is None else condition & year & date
+
+        if columns is None:
+            columns = [name for name in FIELDS if name in dataset.schema.names]
+        table = dataset.to_table(columns=["Date"] + list(columns), filter=condition)
+        data = table.to_pandas().set_index("Date").sort_index()
+        # the index name plot_technical_analyis() expects from yfinance
+        data.index.name = "Datetime" if interval in INTRADAY else "Date"
+        return data
+
+    def last_timestamp(self, coin, interval):
+        """returns the timestamp of the last stored bar, None if nothing is stored"""
+        path = self._path(coin, interval)
+        if not os.path.isdir(path):
+            return None
+        years = [name for name in os.listdir(path) if name.startswith("year=")]
+        if len(years) == 0:
+            return None
+        last_year = max(years, key=lambda name: int(name.split("=")[1]))
+        dates = pq.read_table(os.path.join(path, last_year, "part.parquet"), columns=["Date"], memory_map=True)
+        return pd.Timestamp(dates.column("Date").to_pandas().max())
+
+
+def to_utc(value):
+    """returns value as a timezone naive UTC Timestamp"""
+    value = pd.Timestamp(value)
+    if value.tzinfo is not None:
+        value = value.tz_convert("UTC").tz_localize(None)
+    return value
+
+
+def _timestamp(value, date_type):
+    """converts value to a Timestamp comparable with the Date column"""
+    value = pd.Timestamp(value)
+    tz = getattr(date_type, "tz", None)
+    if tz is not None and value.tzinfo is None:
+        value = value.tz_localize(tz)
+    elif tz is not None:
+        value = value.tz_convert(tz)
+    elif value.tzinfo is not None:
+        value = value.tz_convert(None)
+    return value
+
+
+def import_wide_csvs(store, directory, interval="1d"):
+    """imports the per field csv files of BC4 (close.csv, open.csv, ... with one column per coin) into the store"""
+    files = {"Open": "open.csv", "High": "high.csv", "Low": "low.csv", "Close": "close.csv",
+             "Adj Close": "adj_close.csv", "Volume": "volume.csv"}
+    fields = {field: pd.read_csv(os.path.join(directory, file), index_col="Date", parse_dates=["Date"])
+              for field, file in files.items() if os.path.exists(os.path.join(directory, file))}
+    data = pd.concat(fields, axis=1)
+    for coin in data.columns.get_level_values(1).unique():
+        store.write(coin, interval, data.xs(coin, axis=1, level=1), covered_from=data.index[0])
+
+
+if __name__ == '__main__':
+    # python ohlcv_store.py ../BC4/data_updated
+    import_wide_csvs(OHLCVStore(), sys.argv[1])
@@ -0,0 +1,51 @@
+from acquisition import Acquisition, UpstreamError
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Binance price feed
+#
+# All prices are fetched with a single call to the multi-symbol ticker endpoint through the acquisition layer
+# (acquisition.py: shared event loop, rate limit and retries, one request per symbol if binance rejects the batch) and
+# served stale-while-revalidate: for ttl seconds as they are, then while a background request refreshes them (the
+# prices seeded from the last snapshot too, however old they are). An offline feed only serves the prices it was seeded with (benchmarks, development without network).
+
+
+def binance_name(coin):
+    """returns the name used for the coin on binance (LUNA1-USD was renamed)"""
+    if coin == "LUNA1-USD":
+        return "LUNA-USD"
+    return coin
+
+
+def binance_symbol(coin):
+    """returns the binance USDT ticker symbol of a yahoo coin name, e.g. BTC-USD -> BTCUSDT"""
+    return binance_name(coin).replace("-", "") + "T"
+
+
+class PriceFeed:
+    """current binance prices of the coins, refreshed in the background once they are ttl seconds old"""
+
+    def __init__(self, coins, ttl=30, offline=False, upstream=None):
+        self.coins = list(coins)
+        self.offline = offline
+        self.ttl = ttl
+        self.upstream = upstream or Acquisition()
+        self.symbols = {binance_symbol(coin): binance_name(coin) for coin in self.coins}
+        self._key = ("binance prices", tuple(self.coins))
+
+    def seed(self, prices, fetched):
+        """starts from already known prices (e.g. the last snapshot), fetched is a unix timestamp"""
+        self.upstream.seed(self._key, prices, fetched)
+
+    def prices(self):
+        """returns a frame indexed by binance coin name with a Price column, None if binance was never reached"""
+        if self.offline:
+            return self.upstream.peek(self._key)
+        try:
+            return self.upstream.cached(self._key, self.ttl, lambda: self.upstream.fetch_prices(self.symbols))
+        except UpstreamError as error:
+            print(f"price feed: binance request failed ({error})")
+            return None
+
+    def fetch(self):
+        """downloads the prices of every coin"""
+        return self.upstream.prices(self.symbols)
@@ -0,0 +1,182 @@
+import cProfile
+import hmac
+import json
+import marshal
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from metrics import CALLBACK_PATH, callback_inputs
+
+# ----------------------------------------------------------------------------------------------------------------------
+# On-demand callback profiling
+#
+# Profiles a fraction of the dash callback requests in production, without a redeploy: PROFILE_FRACTION at start, or
+# the admin route at any time, sets the fraction of the callbacks that run under cProfile while a sampler thread
+# records the stack of the request thread every few milliseconds. The last PROFILE_KEEP profiles stay in memory,
+# tagged with the callback and its inputs (coin, range, indicator, ...), and are downloaded as
+#   /admin/profiles/<id>.pstats   cProfile statistics (python -m pstats, snakeviz)
+#   /admin/profiles/<id>.folded   collapsed stacks of the samples, one "frame;frame;frame count" per line
+#                                 (flamegraph.pl, speedscope)
+# /admin/profiles lists them, POST /admin/profiles/sampling?fraction=0.1 changes the fraction. The admin routes need
+# the PROFILE_TOKEN (X-Admin-Token header or token parameter); without one they only answer requests from localhost.
+#
+# A single callback is profiled at a time, cProfile does not support several profilers running at once.
+
+ADMIN_PATH = "/admin/profiles"
+LOCALHOST = {"127.0.0.1", "::1"}
+
+
+class StackSampler:
+    """collapsed stacks of one thread, sampled every interval seconds from a background thread"""
+
+    def __init__(self, thread_id, interval=0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def folded(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _tag(inputs):
+    """short label of the inputs: their plain values, e.g. BTC-USD 1y EMA"""
+    return " ".join(str(value) for value in inputs.values() if isinstance(value, (str, int, float)))
+
+
+class Profiler:
+    """profiles a fraction of the callback requests, keeps the last keep profiles"""
+
+    def __init__(self, fraction=0.0, keep=20, interval=0.005):
+        self.fraction = fraction
+        self.interval = interval
+        self.profiles = deque(maxlen=keep)
+        self._next_id = 1
+        self._busy = threading.Lock()
+        self._lock = threading.Lock()
+        # the profile running in this thread
+        self._local = threading.local()
+
+    def start(self):
+        """starts profiling the request running in this thread if it is sampled, returns whether it is"""
+        if self.fraction <= 0 or random.random() >= self.fraction or not self._busy.acquire(blocking=False):
+            return False
+        sampler = StackSampler(threading.get_ident(), self.interval)
+        profile = cProfile.Profile()
+        self._local.running = (profile, sampler, time.perf_counter())
+        sampler.start()
+        profile.enable()
+        return True
+
+    def stop(self, callback, inputs, status):
+        """stops the profile of this thread and keeps it, returns its id (None if the request was not profiled)"""
+        running = getattr(self._local, "running", None)
+        if running is None:
+            return None
+        profile, sampler, start = running
+        self._local.running = None
+        try:
+            profile.disable()
+            seconds = time.perf_counter() - start
+            sampler.stop()
+        finally:
+            self._busy.release()
+        profile.create_stats()
+        with self._lock:
+            entry = {"id": self._next_id, "time": datetime.now().isoformat(timespec="seconds"), "callback": callback,
+                     "tag": _tag(inputs), "inputs": inputs, "status": status, "ms": round(seconds * 1000, 1),
+                     "samples": sum(sampler.stacks.values()), "pstats": marshal.dumps(profile.stats),
+                     "folded": sampler.folded()}
+            self._next_id += 1
+            self.profiles.append(entry)
+        return entry["id"]
+
+    def get(self, profile_id):
+        with self._lock:
+            return next((entry for entry in self.profiles if entry["id"] == profile_id), None)
+
+    def list(self):
+        """the kept profiles without their data, newest first"""
+        with self._lock:
+            return [{key: value for key, value in entry.items() if key not in ["pstats", "folded"]}
+                    for entry in reversed(self.profiles)]
+
+    def instrument(self, server, token=None):
+        """profiles the sampled dash callback requests of the flask server and adds the admin routes"""
+        from flask import Response, abort, jsonify, request
+
+        @server.before_request
+        def start_profile():
+            if request.path.endswith(CALLBACK_PATH):
+                self.start()
+
+        @server.after_request
+        def stop_profile(response):
+            if getattr(self._local, "running", None) is not None:
+                body = request.get_json(silent=True) or {}
+                self.stop(body.get("output", "unknown"), callback_inputs(body), response.status_code)
+            return response
+
+        @server.teardown_request
+        def release_profile(error=None):
+            # a request that failed without a response does not keep the profiler
+            if getattr(self._local, "running", None) is not None:
+                self.stop("unknown", {}, 500)
+
+        def admin():
+            if token is None:
+                allowed = request.remote_addr in LOCALHOST
+            else:
+                given = request.headers.get("X-Admin-Token") or request.args.get("token") or ""
+                allowed = hmac.compare_digest(given.encode(), token.encode())
+            if not allowed:
+                abort(403)
+
+        @server.route(ADMIN_PATH)
+        def list_profiles():
+            admin()
+            return jsonify({"fraction": self.fraction, "profiles": self.list()})
+
+        @server.route(ADMIN_PATH + "/sampling", methods=["POST"])
+        def set_sampling():
+            admin()
+            try:
+                self.fraction = min(1.0, max(0.0, float(request.values["fraction"])))
+            except (KeyError, ValueError):
+                abort(400)
+            return jsonify({"fraction": self.fraction})
+
+        @server.route(ADMIN_PATH + "/<int:profile_id>.<kind>")
+        def download_profile(profile_id, kind):
+            admin()
+            entry = self.get(profile_id)
+            if entry is None or kind not in ["pstats", "folded"]:
+                abort(404)
+            name = f"profile-{entry['id']}-{entry['tag']}".replace(" ", "_").replace("/", "-") + "." + kind
+            mimetype = "application/octet-stream" if kind == "pstats" else "text/plain"
+            return Response(entry[kind], mimetype=mimetype,
+                            headers={"Content-Disposition": f"attachment; filename={json.dumps(name)}"})
@@ -0,0 +1,130 @@
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+
+from ohlcv_store import OHLCVStore
+from price_feed import binance_symbol
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Replay server
+#
+# Stands in for the binance websocket stream (stream.py) without network: replays the last days of the 15m bars of the
+# local store as a combined kline stream, shifted so the first replayed bar opens at the current quarter hour. Every
+# bar is sent as steps updates going from its open through its low and high to its close, the daily klines are
+# aggregated from them. speed > 1 plays the bars faster than real time.
+#
+#   cd BC5 && python replay_server.py [--port 8765] [--speed 1] [--days 1] [--steps 15]
+#   cd BC5 && STREAM_URL=ws://localhost:8765/stream python app.py
+
+BAR_MS = 15 * 60 * 1000
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def bar_path(open_, high, low, close, steps):
+    """returns steps prices through a bar: from open to its nearer extreme, to the other one and to close"""
+    first, second = (low, high) if close >= open_ else (high, low)
+    return np.interp(np.linspace(0, 3, steps + 1)[1:], [0, 1, 2, 3], [open_, first, second, close])
+
+
+def kline_event(symbol, interval, open_time, length, bar, time_ms, closed):
+    """returns a combined stream kline event, bar is (open, high, low, close, volume)"""
+    kline = {"t": open_time, "T": open_time + length - 1, "s": symbol, "i": interval, "x": closed}
+    kline.update({field: "%.8f" % value for field, value in zip(["o", "h", "l", "c", "v"], bar)})
+    return {"stream": f"{symbol.lower()}@kline_{interval}", "data": {"e": "kline", "E": time_ms, "s": symbol,
+                                                                     "k": kline}}
+
+
+class Replay:
+    """kline events of the stored 15m bars of the coins"""
+
+    def __init__(self, store, coins, days=1, steps=15):
+        self.steps = steps
+        # binance symbol -> array of (open, high, low, close, volume) rows
+        self.bars = {}
+        for coin in coins:
+            bars = store.read(coin, "15m")
+            if bars is None or len(bars) == 0:
+                print(f"replay: no 15m bars of {coin} in the store")
+                continue
+            bars = bars[["Open", "High", "Low", "Close", "Volume"]].dropna().tail(days * 96)
+            self.bars[binance_symbol(coin)] = bars.to_numpy(dtype="float64")
+
+    def events(self, streams, start_ms):
+        """yields (time in ms, event) for the subscribed kline streams, the first bar opening at start_ms"""
+        subscribed = {}
+        for stream in streams:
+            symbol, _, kind = stream.partition("@")
+            if kind.startswith("kline_") and symbol.upper() in self.bars:
+                subscribed.setdefault(symbol.upper(), []).append(kind[len("kline_"):])
+        if len(subscribed) == 0:
+            return
+        # symbol -> [open time, open, high, low, volume of the finished bars] of the current day
+        days = {symbol: None for symbol in subscribed}
+        for i in range(min(len(self.bars[symbol]) for symbol in subscribed)):
+            open_time = start_ms + i * BAR_MS
+            for symbol in subscribed:
+                day_open = open_time // DAY_MS * DAY_MS
+                if days[symbol] is None or days[symbol][0] != day_open:
+                    open_ = self.bars[symbol][i, 0]
+                    days[symbol] = [day_open, open_, open_, open_, 0.0]
+            paths = {symbol: bar_path(*self.bars[symbol][i, :4], self.steps) for symbol in subscribed}
+
+            for step in range(self.steps):
+                time_ms = open_time + (step + 1) * BAR_MS // self.steps - 1
+                closed = step == self.steps - 1
+                for symbol, intervals in subscribed.items():
+                    open_, volume = self.bars[symbol][i, 0], self.bars[symbol][i, 4]
+                    seen = paths[symbol][:step + 1]
+                    bar = (open_, max(open_, seen.max()), min(open_, seen.min()), seen[-1],
+                           volume * (step + 1) / self.steps)
+                    day = days[symbol]
+                    day[2], day[3] = max(day[2], bar[1]), min(day[3], bar[2])
+                    day_bar = (day[1], day[2], day[3], bar[3], day[4] + bar[4])
+                    if closed:
+                        day[4] += volume
+                    if "15m" in intervals:
+                        yield time_ms, kline_event(symbol, "15m", open_time, BAR_MS, bar, time_ms, closed)
+                    if "1d" in intervals:
+                        yield time_ms, kline_event(symbol, "1d", day[0], DAY_MS, day_bar, time_ms, False)
+
+
+def serve_replay(replay, host="localhost", port=8765, speed=1.0):
+    """serves the replay to every client that connects, each one from the start"""
+    from websockets.exceptions import ConnectionClosed
+    from websockets.sync.server import serve
+
+    def handler(connection):
+        streams = parse_qs(urlparse(connection.request.path).query).get("streams", [""])[0].split("/")
+        start_ms = int(time.time() * 1000) // BAR_MS * BAR_MS
+        started = time.time()
+        try:
+            for time_ms, event in replay.events(streams, start_ms):
+                delay = started + (time_ms - start_ms) / 1000 / speed - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                connection.send(json.dumps(event))
+        except ConnectionClosed:
+            pass
+
+    with serve(handler, host, port) as server:
+        print(f"replay: {len(replay.bars)} coins on ws://{host}:{port}/stream at {speed}x")
+        server.serve_forever()
+
+
+def main():
+    def option(name, default):
+        return type(default)(sys.argv[sys.argv.index(name) + 1]) if name in sys.argv else default
+
+    directory = option("--store", "store")
+    store = OHLCVStore(directory)
+    coins = sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+    replay = Replay(store, coins, days=option("--days", 1), steps=option("--steps", 15))
+    serve_replay(replay, port=option("--port", 8765), speed=option("--speed", 1.0))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import threading
+import time
+
+import metrics
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Request coalescing cache
+#
+# Keeps the result of an expensive call (an upstream download) for a time to live. When several requests ask for the
+# same missing key at once only the first one calls the loader, the others wait for its result, so ten users opening
+# BTC-USD together trigger a single download.
+
+
+class _Pending:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class CoalescingCache:
+    """key -> (value, expiry) with deduplication of concurrent loads"""
+
+    def __init__(self, max_entries=256, name=None):
+        self.max_entries = max_entries
+        # counted in the cache metrics under this name (metrics.py)
+        self.name = name
+        self._values = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, ttl, load):
+        """returns the cached value of key if younger than ttl seconds, otherwise load() shared by concurrent callers
+
+        ttl can also be a function, called once the value is loaded, returning its time to live"""
+        with self._lock:
+            cached = self._values.get(key)
+            if cached is not None and cached[1] > time.time():
+                self._count("hit")
+                return cached[0]
+            pending = self._pending.get(key)
+            owner = pending is None
+            # a caller waiting for the load of another one is counted as a hit
+            self._count("miss" if owner else "hit")
+            if owner:
+                pending = self._pending[key] = _Pending()
+
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.value
+
+        try:
+            pending.value = load()
+        except Exception as error:
+            pending.error = error
+            raise
+        finally:
+            with self._lock:
+                if pending.error is None:
+                    self._values[key] = (pending.value, time.time() + (ttl() if callable(ttl) else ttl))
+                    self._evict()
+                del self._pending[key]
+            pending.done.set()
+        return pending.value
+
+    def _count(self, result):
+        if self.name is not None:
+            metrics.cache_result(self.name, result)
+
+    def invalidate(self, key=None):
+        """forgets key, or everything when key is None"""
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
+
+    def _evict(self):
+        if len(self._values) <= self.max_entries:
+            return
+        now = time.time()
+        for key in [key for key, (value, expiry) in self._values.items() if expiry <= now]:
+            del self._values[key]
+        # still too many: drop the entries closest to expiry
+        while len(self._values) > self.max_entries:
+            del self._values[min(self._values, key=lambda key: self._values[key][1])]
@@ -0,0 +1,156 @@
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import forecast
+import metrics
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Background precompute of the predictions
+#
+# The predictions of every coin are computed in a pool of worker processes when the server starts and again
+# whenever a new daily bar shows up in the one year data, so model training never runs inside a request. The callbacks only
+# read the result table. The table can be any dict-like object; the app uses a diskcache.Cache so the background
+# callbacks, which run in their own processes, read the same results.
+#
+# With batched=True all coins with a complete window go to the worker as one job training a single model for the
+# universe (forecast.predict_batch); coins with gaps in their last 100 days are predicted on their own from their last
+# 100 valid closes.
+
+
+def _predict(coin, closes, backend):
+    """job run in the worker processes"""
+    return {coin: forecast.predict_prices(coin, closes, backend)}
+
+
+def _predict_batch(coins, closes, backend):
+    """job run in the worker processes, one model for all coins"""
+    return forecast.predict_batch(coins, closes, backend)
+
+
+def _timed(job, *args):
+    """runs job in the worker process, returns (seconds it took, its result)"""
+    start = time.perf_counter()
+    result = job(*args)
+    return time.perf_counter() - start, result
+
+
+class PredictionScheduler:
+    """keeps a table coin -> predictions up to date by recomputing it in a process pool"""
+
+    def __init__(self, coins, get_data, max_workers=2, poll_seconds=300, results=None, backend="ridge",
+                 batched=False):
+        # get_data returns the current one year daily frame (data_lb_1y), backend is a key of forecast.FORECASTERS
+        self.coins = list(coins)
+        self.get_data = get_data
+        self.backend = backend
+        self.batched = batched
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        # coin -> {"price_tmr", "price_tmr2", "updated", "refreshing_since"}
+        self._results = {} if results is None else results
+        self._pending = {}
+        self._last_bars = {}
+        self._lock = threading.Lock()
+        # refresh() runs from the watcher thread and from the market data listeners
+        self._refresh_lock = threading.Lock()
+        self._pool = None
+        self._thread = None
+
+    def start(self):
+        """starts the worker processes, submits every coin and starts watching for new daily bars"""
+        if self._pool is not None:
+            return
+        # spawn instead of fork: tensorflow is not fork safe and the workers should not inherit the dash app
+        self._pool = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        self.refresh()
+        self._thread = threading.Thread(target=self._watch, name="prediction-scheduler", daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_seconds)
+            try:
+                self.refresh()
+            except Exception as error:
+                print(f"prediction scheduler: refresh failed ({error})")
+
+    def refresh(self):
+        """submits every coin whose last daily bar changed since its last prediction"""
+        with self._refresh_lock:
+            self._refresh()
+
+    def _refresh(self):
+        data = self.get_data()
+        if self._pool is None or data is None:
+            return
+        closes = data["Close"].reindex(columns=self.coins).tail(100)
+        last_bars = {coin: closes[coin].dropna().index.max() for coin in self.coins}
+        with self._lock:
+            changed = [coin for coin in self.coins
+                       if coin not in self._pending and self._last_bars.get(coin) != last_bars[coin]]
+        if len(changed) == 0:
+            return
+
+        if self.batched:
+            batch = [coin for coin in self.coins if coin not in self._pending and closes[coin].notna().all()]
+            # the model is shared, so a new bar of any coin retrains it for all of them
+            if any(coin in batch for coin in changed):
+                self._submit(batch, last_bars, _predict_batch, batch, closes[batch], self.backend)
+            changed = [coin for coin in changed if coin not in batch]
+        for coin in changed:
+            self._submit([coin], last_bars, _predict, coin, data["Close", coin].dropna().tail(100), self.backend)
+
+    def _submit(self, coins, last_bars, job, *args):
+        with self._lock:
+            future = self._pool.submit(_timed, job, *args)
+            for coin in coins:
+                self._last_bars[coin] = last_bars[coin]
+                self._pending[coin] = future
+                result = dict(self._results.get(coin, {"price_tmr": None, "price_tmr2": None, "updated": None}))
+                result["refreshing_since"] = datetime.now()
+                self._results[coin] = result
+        # the model fits are timed as the "<backend>" (or "<backend> batch") stage of forecast in the metrics
+        stage = self.backend + (" batch" if job is _predict_batch else "")
+        future.add_done_callback(lambda future: self._done(coins, future, stage))
+
+    def _done(self, coins, future, stage):
+        if future.exception() is None:
+            metrics.observe_stage("forecast", stage, future.result()[0])
+        with self._lock:
+            for coin in coins:
+                self._pending.pop(coin, None)
+                result = dict(self._results.get(coin, {}))
+                result["refreshing_since"] = None
+                if future.exception() is not None:
+                    # forget the bar so the next refresh tries again
+                    self._last_bars.pop(coin, None)
+                    print(f"prediction scheduler: {coin} failed ({future.exception()})")
+                else:
+                    result["price_tmr"], result["price_tmr2"] = future.result()[1][coin]
+                    result["updated"] = datetime.now()
+                self._results[coin] = result
+
+    def get(self, coin, timeout=None, poll_seconds=0.5):
+        """returns the result of the coin as a dict (price_tmr, price_tmr2, updated, stale_since) or None
+
+        stale_since is set while a newer prediction is being computed. When the coin has no result yet the call waits
+        up to timeout seconds for its first computation. Only the result table is read, so any process sharing it can
+        call this."""
+        deadline = time.time() + (timeout or 0)
+        while True:
+            result = self._results.get(coin)
+            if result is not None and result["price_tmr"] is not None:
+                break
+            if time.time() >= deadline:
+                return None
+            time.sleep(poll_seconds)
+        return {"price_tmr": result["price_tmr"], "price_tmr2": result["price_tmr2"], "updated": result["updated"],
+                "stale_since": result["refreshing_since"]}
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
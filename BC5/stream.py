@@ -0,0 +1,237 @@
+import json
+import os
+import threading
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from price_feed import binance_name, binance_symbol
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Live market stream
+#
+# A background thread consumes the combined kline stream of binance (one websocket carrying <symbol>@kline_<interval>
+# of every coin, mini ticker events are read as well) and keeps the last updates of every coin in fixed size ring
+# buffers. Every update gets a sequence number, so the dashboard asks for what arrived since the number it last saw
+# and sends the browser only those bars (dash.Patch), instead of building and sending the figures again.
+#
+# Any server speaking the same format can stand in for binance: replay_server.py replays the bars of the local store
+# for development and benchmarks without network.
+#
+# A forked process (the background callbacks of the DiskcacheManager) does not inherit the thread filling the buffers:
+# there the stream is stopped and serves no live price, the callers fall back to the price feed.
+
+BINANCE_STREAM_URL = "wss://stream.binance.com:9443/stream"
+
+# one row per kline update, the times are milliseconds since the epoch (UTC)
+KLINE = [("seq", "i8"), ("open_time", "i8"), ("open", "f8"), ("high", "f8"), ("low", "f8"), ("close", "f8"),
+         ("volume", "f8")]
+TICK = [("seq", "i8"), ("time", "i8"), ("price", "f8")]
+
+
+def epoch_ms(timestamp):
+    """returns a bar timestamp (timezone naive ones are UTC) as milliseconds since the epoch"""
+    timestamp = pd.Timestamp(timestamp)
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.tz_localize("UTC")
+    return timestamp.value // 10 ** 6
+
+
+class RingBuffer:
+    """the last capacity rows of a numpy record type, the first field is the sequence number of the row"""
+
+    def __init__(self, capacity, dtype):
+        self.rows = np.zeros(capacity, dtype=dtype)
+        self.count = 0
+        # sequence number of the last row that was overwritten
+        self.dropped = 0
+
+    def append(self, row):
+        position = self.count % len(self.rows)
+        if self.count >= len(self.rows):
+            self.dropped = self.rows[position]["seq"]
+        self.rows[position] = row
+        self.count += 1
+
+    def last(self):
+        if self.count == 0:
+            return None
+        return self.rows[(self.count - 1) % len(self.rows)]
+
+    def since(self, seq):
+        """returns the rows after sequence number seq, oldest first"""
+        kept = min(self.count, len(self.rows))
+        rows = self.rows[np.arange(self.count - kept, self.count) % len(self.rows)]
+        return rows[rows["seq"] > seq]
+
+
+# the streams of this process, stopped in a forked child
+_instances = weakref.WeakSet()
+
+
+def _after_fork():
+    for stream in list(_instances):
+        stream._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
+
+
+class LiveStream:
+    """ring buffers of the last kline updates (per coin and interval) and prices (per coin) of a binance stream"""
+
+    def __init__(self, coins, intervals=("15m", "1d"), url=BINANCE_STREAM_URL, capacity=512, reconnect_seconds=5):
+        self.coins = list(coins)
+        self.intervals = list(intervals)
+        self.url = url
+        self.reconnect_seconds = reconnect_seconds
+        self.seq = 0
+        self.connected = False
+        self._symbols = {binance_symbol(coin): coin for coin in self.coins}
+        self._klines = {(coin, interval): RingBuffer(capacity, KLINE) for coin in self.coins for interval in intervals}
+        self._ticks = {coin: RingBuffer(capacity, TICK) for coin in self.coins}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._connection = None
+        _instances.add(self)
+
+    def streams(self):
+        """names of the subscribed streams"""
+        return [f"{symbol.lower()}@kline_{interval}" for symbol in self._symbols for interval in self.intervals]
+
+    def start(self):
+        threading.Thread(target=self._run, name="live-stream", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._connection is not None:
+            self._connection.close()
+
+    def _after_fork(self):
+        """stops the stream in a forked child: the buffers are a copy no thread updates, and the lock may have been
+        held by the stream thread of the parent when it forked"""
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stop.set()
+        # the socket belongs to the parent
+        self._connection = None
+        self.connected = False
+
+    def _run(self):
+        try:
+            from websockets.exceptions import WebSocketException
+            from websockets.sync.client import connect
+        except ImportError as error:
+            print(f"live stream: not started ({error})")
+            return
+
+        url = self.url + "?streams=" + "/".join(self.streams())
+        while not self._stop.is_set():
+            try:
+                with connect(url, open_timeout=10, max_size=2 ** 20) as connection:
+                    self._connection = connection
+                    self.connected = True
+                    for message in connection:
+                        self.handle(json.loads(message))
+            except (OSError, ValueError, WebSocketException) as error:
+                print(f"live stream: disconnected ({error})")
+            self._connection = None
+            self.connected = False
+            # binance closes every connection after 24h, reconnecting also covers network failures
+            self._stop.wait(self.reconnect_seconds)
+
+    def handle(self, message):
+        """stores one stream event, combined ({"stream": ..., "data": event}) or not"""
+        event = message.get("data", message)
+        coin = self._symbols.get(event.get("s"))
+        if coin is None:
+            return
+        with self._lock:
+            if event.get("e") == "kline":
+                kline = event["k"]
+                ring = self._klines.get((coin, kline["i"]))
+                if ring is not None:
+                    self.seq += 1
+                    ring.append((self.seq, kline["t"], float(kline["o"]), float(kline["h"]), float(kline["l"]),
+                                 float(kline["c"]), float(kline["v"])))
+                price = float(kline["c"])
+            elif event.get("e") == "24hrMiniTicker":
+                price = float(event["c"])
+            else:
+                return
+            self.seq += 1
+            self._ticks[coin].append((self.seq, event["E"], price))
+
+    def price(self, coin):
+        """returns the last price of the coin, None before its first event or once the stream is stopped"""
+        if self._stop.is_set():
+            return None
+        with self._lock:
+            tick = self._ticks[coin].last()
+        return None if tick is None else float(tick["price"])
+
+    def latest(self, prices):
+        """returns prices (a PriceFeed frame, indexed by binance name) with the last streamed price of every coin"""
+        live = {binance_name(coin): self.price(coin) for coin in self.coins}
+        live = {name: price for name, price in live.items() if price is not None}
+        if len(live) == 0 or prices is None:
+            return prices
+        prices = prices.copy()
+        for name, price in live.items():
+            prices.loc[name, "Price"] = np.round(price, 3)
+        return prices
+
+    def updates(self, coin, interval, seq=0):
+        """returns (sequence number, klines, complete): the last update of every bar of the coin changed after seq,
+        ordered by open time, and the sequence number to ask from next time
+
+        complete is False when updates after seq were already dropped from the ring, then the bars are not enough to
+        bring a figure up to date. seq=0 asks for everything still in the ring"""
+        with self._lock:
+            ring = self._klines[(coin, interval)]
+            rows = ring.since(seq)
+            complete = seq == 0 or seq >= ring.dropped
+            current = self.seq
+        # every update carries the whole bar, only the last one of each bar is needed
+        _, last = np.unique(rows["open_time"][::-1], return_index=True)
+        return current, rows[len(rows) - 1 - last], complete
+
+
+def extend_figures(cursor, klines):
+    """returns (candlestick patch, volume patch) applying klines (see LiveStream.updates) to the live traces of the
+    technical analysis figures, None when there is nothing to apply
+
+    cursor describes the figures in the browser (see the stream_cursor callback state in app.py): since is the open
+    time of their last bar, times the open times of the bars already in the live traces. It is updated in place."""
+    from dash import Patch
+
+    klines = klines[klines["open_time"] >= cursor["since"]]
+    if len(klines) == 0:
+        return None
+    candles, volume = Patch(), Patch()
+    candle_trace, volume_trace = candles["data"][cursor["candles"]], volume["data"][cursor["volume"]]
+    times = cursor["times"]
+
+    # bars already drawn are changed in place
+    last = times[-1] if len(times) > 0 else -1
+    for kline in klines[klines["open_time"] <= last]:
+        if int(kline["open_time"]) not in times:
+            continue
+        i = times.index(int(kline["open_time"]))
+        for field in ["open", "high", "low", "close"]:
+            candle_trace[field][i] = float(kline[field])
+        volume_trace["y"][i] = float(kline["volume"])
+
+    # new bars are appended, their open time (ms) is a date on the date axes of the figures
+    new = klines[klines["open_time"] > last]
+    if len(new) > 0:
+        open_times = new["open_time"].tolist()
+        candle_trace["x"].extend(open_times)
+        for field in ["open", "high", "low", "close"]:
+            candle_trace[field].extend(new[field].tolist())
+        volume_trace["x"].extend(open_times)
+        volume_trace["y"].extend(new["volume"].tolist())
+        times.extend(open_times)
+    return candles, volume
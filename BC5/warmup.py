@@ -0,0 +1,88 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import plotly.io as pio
+
+import charts
+from indicators import IndicatorEngine
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Warm-up of the technical analysis figures
+#
+# Builds the figures of every (coin, range, indicator) of the dropdowns before anybody asks for them. The bars are
+# loaded by a thread pool (downloads and store reads wait on I/O) and, as soon as the bars of a (coin, range) arrive,
+# the indicators and figures of both indicators are built in a process pool, so the CPU work runs on every core instead
+# of one thread holding the GIL. The workers also serialize the figures, the results go into the figure cache the
+# callback reads (figure_cache.py).
+
+
+def _build(coin, range, indicators, df):
+    """job run in the worker processes, returns {indicator: (data version, [candlestick json, volume json])}"""
+    indicator_engine = IndicatorEngine(max_series=len(indicators))
+    version = charts.data_version(df)
+    figures = {}
+    for indicator in indicators:
+        fig1, fig2 = charts.technical_analysis(coin, range, indicator, df, indicator_engine)
+        figures[indicator] = (version, [pio.to_json(fig1, validate=False), pio.to_json(fig2, validate=False)])
+    return figures
+
+
+class WarmUp:
+    """fills the figure cache with the (coin, range, indicator) figures of every combination"""
+
+    def __init__(self, coins, ranges, indicators, history, figures, io_workers=8, cpu_workers=None):
+        # history(coin, period, interval) returns the bars plot_technical_analyis() would use, figures is a FigureCache
+        self.coins = list(coins)
+        self.ranges = list(ranges)
+        self.indicators = list(indicators)
+        self.history = history
+        self.figures = figures
+        self.io_workers = io_workers
+        self.cpu_workers = cpu_workers or os.cpu_count()
+        self._running = threading.Lock()
+
+    def start(self):
+        """runs the warm-up in a background thread unless one is already running"""
+        threading.Thread(target=self._run_safe, name="warm-up", daemon=True).start()
+
+    def _run_safe(self):
+        try:
+            self.run()
+        except Exception as error:
+            print(f"warm-up: failed ({error})")
+
+    def run(self):
+        """builds every variant, returns the number of figures built (None if a warm-up was already running)"""
+        if not self._running.acquire(blocking=False):
+            return None
+        try:
+            start = time.time()
+            built = 0
+            # spawn instead of fork: the workers should not inherit the dash app and its threads
+            with ThreadPoolExecutor(max_workers=self.io_workers) as io_pool, \
+                    ProcessPoolExecutor(max_workers=self.cpu_workers,
+                                        mp_context=multiprocessing.get_context("spawn")) as cpu_pool:
+                loads = {io_pool.submit(self.history, coin, range, charts.ta_parameters(range)[0]): (coin, range)
+                         for coin in self.coins for range in self.ranges}
+                builds = {}
+                for load in as_completed(loads):
+                    coin, range = loads[load]
+                    if load.exception() is not None:
+                        print(f"warm-up: {coin} {range} not loaded ({load.exception()})")
+                        continue
+                    builds[cpu_pool.submit(_build, coin, range, self.indicators, load.result())] = (coin, range)
+                for build in as_completed(builds):
+                    coin, range = builds[build]
+                    if build.exception() is not None:
+                        print(f"warm-up: {coin} {range} not built ({build.exception()})")
+                        continue
+                    for indicator, (version, serialized) in build.result().items():
+                        self.figures.put_json((coin, range, indicator), version, serialized)
+                        built += 1
+            print(f"warm-up: {built} figures in {time.time() - start:.1f}s on {self.cpu_workers} processes")
+            return built
+        finally:
+            self._running.release()
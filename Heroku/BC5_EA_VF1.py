@@ -1,26 +1,24 @@
 import numpy as np
 import pandas as pd
-import yfinance as yf
-from datetime import datetime
-from dateutil.relativedelta import relativedelta
 import plotly.graph_objs as go
 import dash_bootstrap_components as dbc
 import dash
 from dash import dcc, Dash, html
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import base64
-from plotly.subplots import make_subplots
 import json
-import requests
+import os
 import warnings
 from math import ceil
 from datetime import timedelta
-from sklearn.preprocessing import MinMaxScaler
-import tensorflow as tf
-import django_heroku
+# yfinance, scikit-learn, tensorflow and plotly.subplots are imported in the functions using them, so the dyno binds
+# its port without loading them first
 # from tensorflow.keras.models import Sequential
 # from tensorflow.keras.layers import Dense, Dropout, LSTM
 import datetime as dt
+from data_provider import COINS, MarketData
+from shared_cache import SharedSnapshot
 warnings.filterwarnings("ignore")
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -32,10 +30,8 @@ server = app.server
 # ----------------------------------------------------------------------------------------------------------------------
 # Building the necessary elements / functions
 
-coins_bc4 = ['ADA-USD', 'ATOM-USD', 'AVAX-USD', 'AXS-USD', 'LUNA1-USD', 'MATIC-USD', 'BTC-USD', 'ETH-USD', 'SOL-USD', "LINK-USD"]
-coins_added = ["DOGE-USD", "DOT-USD", "TRX-USD", "SHIB-USD", "LTC-USD", "XMR-USD", "FLOW-USD", "HNT-USD", "QNT-USD", "PAXG-USD"]
-coins = coins_bc4 + coins_added
-coins.sort()
+# listed in data_provider.py, the refresher process downloads the same coins
+coins = list(COINS)
 
 dropdown_leaderboard = dcc.Dropdown(
     id='leaderboard_drop',
@@ -78,27 +74,14 @@ dropdown_tech_analysis_indicator = dcc.Dropdown(
     style={"box-shadow" : "1px 1px 3px lightgray", "background-color" : "white"}
     )
 
-#downloading all data that will be needed for the leaderboard
-data_lb_1d = yf.download(tickers=coins, period = "1d", interval = "15m")
-data_lb_5d = yf.download(tickers=coins, period = "5d", interval = "60m")
-data_lb_1y = yf.download(tickers=coins, period = "1y", interval = "1d")
-data_lb_1mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=1)].set_index("Date")
-data_lb_2mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=2)].set_index("Date")
-data_lb_3mo = data_lb_1y.reset_index().loc[data_lb_1y.reset_index()["Date"] >= datetime.now() - relativedelta(months=3)].set_index("Date")
-
-#donwloading coin price 
-leaderboard_prices = pd.DataFrame(columns = ["Price"])
-for coin in coins:
-    if coin == "LUNA1-USD":
-        coin = "LUNA-USD"
-    key = "https://api.binance.com/api/v3/ticker/price?symbol="
-    coin_key = coin.replace("-", "")
-    coin_key = coin_key + "T"
-    url = key + coin_key
-    data = requests.get(url)
-    data = data.json()
-    rounded = np.round(float(data["price"]), 3)
-    leaderboard_prices.loc[coin] = rounded
+# leaderboard data and prices: served from the last local snapshot while fresh data is downloaded in the background.
+# Under gunicorn (MARKET_DATA=shared, see gunicorn.conf.py) the workers read what the refresher process publishes in
+# shared memory instead, run on its own the app downloads them itself
+if os.environ.get("MARKET_DATA") == "shared":
+    market_data = MarketData(coins, directory="snapshot", shared=SharedSnapshot())
+else:
+    market_data = MarketData(coins, directory="snapshot")
+market_data.start()
 
 
 # ----------------------------------------------------------------------------------------------------------------------
@@ -111,18 +94,10 @@ def create_leaderboard(lb_range = "1d"):
     """creates a leaderboard of the most performing coins in a time range 
     possible values for argument: one day 1d, five days 5d, one month 1mo, 2months 2mo, one quarter 3mo, one year 1y"""
 
-    if (lb_range == "1d"):
-        data_lb = data_lb_1d
-    elif (lb_range == "5d"):
-        data_lb = data_lb_5d
-    elif (lb_range == "1mo"):
-        data_lb = data_lb_1mo
-    elif (lb_range == "2mo"):
-        data_lb = data_lb_2mo
-    elif (lb_range == "3mo"):
-        data_lb = data_lb_3mo
-    else:
-        data_lb = data_lb_1y
+    if lb_range not in ["1d", "5d", "1mo", "2mo", "3mo"]:
+        lb_range = "1y"
+    data_lb = market_data.frame(lb_range)
+    leaderboard_prices = market_data.prices
 
     # creating empty df
     leaderboard_prc = pd.DataFrame(columns = ["Percentage"])
@@ -199,6 +174,8 @@ def plot_technical_analyis(coin='BTC-USD', range="max", indicator = "EMA"):
     # display_table - (bool)whether to display the date and price table at buy/sell positions(True/False)
     
     
+    import yfinance as yf
+
     short_window = 20
     long_window = 50
 
@@ -357,7 +334,7 @@ def plot_technical_analyis(coin='BTC-USD', range="max", indicator = "EMA"):
 
 def plot_info_coin(coin = 'BTC-USD'):
     #changes code for binance API
-    rounded = leaderboard_prices.loc[coin][0].astype("str")
+    rounded = market_data.prices.loc[coin][0].astype("str")
     string = "Today's price for \n" + coin + "\n is \n" + rounded + "\n USD"
     return string
 
@@ -368,9 +345,12 @@ def prediction(coin='BTC-USD'):
     #df = yf.download(tickers=coin, start=start,end=end, interval="1d")
     #df = pd.DataFrame(df['Close'])
 
-    df = pd.DataFrame(data_lb_1y["Close", coin])
+    df = pd.DataFrame(market_data.frame("1y")["Close", coin])
     df = df["Close"].tail(100)
 
+    import tensorflow as tf
+    from sklearn.preprocessing import MinMaxScaler
+
     tf.random.set_seed(12)
 
     # scaling for better LSTM performance
@@ -542,6 +522,11 @@ style={'background-color':'#dae9f5',
     [Input('leaderboard_drop', 'value')])
 
 def plot(range):
+    from plotly.subplots import make_subplots
+
+    # first run of the dashboard without a snapshot on disk
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
     data_lb, leaderboard = create_leaderboard(range)
     top1, coin1, top2, coin2, bot1, coin3, bot2, coin4 = get_top_bot(data_lb, leaderboard)
     plt_coins = make_subplots(rows = 2, cols = 2, subplot_titles=(coin1, coin2, coin3, coin4))
@@ -580,6 +565,8 @@ def plot(coin, range, indicator):
     # first run of the dashboard
     if coin not in coins:
         coin = "BTC-USD"
+    if not market_data.wait(timeout=30):
+        raise PreventUpdate
     ta, ta_vol = plot_technical_analyis(coin, range, indicator)
     price = plot_info_coin(coin)
     pred1, pred2 = get_predictions(coin)
@@ -589,5 +576,3 @@ def plot(coin, range, indicator):
 # Running the app
 if __name__ == '__main__':
     app.run_server(debug=True)
-
-django_heroku.settings(locals())
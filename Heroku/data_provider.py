@@ -0,0 +1,149 @@
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import requests
+from dateutil.relativedelta import relativedelta
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Market data provider
+#
+# Nothing is downloaded when the app is imported: the provider starts from the last snapshot written to disk and
+# fetches fresh data in a background thread. The callbacks read the frames through the provider and wait (briefly) only
+# when the very first fetch has not finished and there is no snapshot yet.
+#
+# Under gunicorn the workers do not download: a shared provider (shared=SharedSnapshot()) reads the snapshots the
+# refresher process publishes in shared memory (refresher.py, shared_cache.py).
+
+# the coins of the dashboard, the ones of BC4 and the ones added for BC5
+coins_bc4 = ['ADA-USD', 'ATOM-USD', 'AVAX-USD', 'AXS-USD', 'LUNA1-USD', 'MATIC-USD', 'BTC-USD', 'ETH-USD', 'SOL-USD', "LINK-USD"]
+coins_added = ["DOGE-USD", "DOT-USD", "TRX-USD", "SHIB-USD", "LTC-USD", "XMR-USD", "FLOW-USD", "HNT-USD", "QNT-USD", "PAXG-USD"]
+COINS = sorted(coins_bc4 + coins_added)
+
+
+class MarketData:
+    """leaderboard frames and binance prices, loaded from a local snapshot and refreshed in the background"""
+
+    def __init__(self, coins, directory="snapshot", shared=None, poll_seconds=5):
+        self.coins = list(coins)
+        self.path = os.path.join(directory, "market_data.pkl")
+        self.snapshot = None
+        # shared cache the snapshots are read from (checked for a new one every poll_seconds), None to download them
+        self.shared = shared
+        self.poll_seconds = poll_seconds
+        self._polled = 0
+        self._loaded = threading.Event()
+        self._listeners = []
+        self._thread = None
+
+    def start(self):
+        """loads the last snapshot from disk and starts the first download in the background"""
+        if self._thread is not None or self.shared is not None:
+            return
+        self.load_snapshot()
+        self._thread = threading.Thread(target=self._refresh_safe, name="market-data", daemon=True)
+        self._thread.start()
+
+    def subscribe(self, listener):
+        """listener() is called after every successful refresh"""
+        self._listeners.append(listener)
+
+    def load_snapshot(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            snapshot = pd.read_pickle(self.path)
+        except Exception as error:
+            print(f"market data: could not read the snapshot ({error})")
+            return
+        self._swap(snapshot)
+
+    def save_snapshot(self, snapshot):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        pd.to_pickle(snapshot, tmp_path)
+        os.replace(tmp_path, self.path)
+
+    def _swap(self, snapshot):
+        # a single reference assignment, readers always see a complete snapshot
+        self.snapshot = snapshot
+        self._loaded.set()
+
+    def _refresh_safe(self):
+        try:
+            self.refresh()
+        except Exception as error:
+            print(f"market data: refresh failed, serving the last snapshot ({error})")
+
+    def refresh(self):
+        """downloads every frame and price, stores the snapshot on disk and swaps it in"""
+        import yfinance as yf
+
+        snapshot = {
+            "1d": yf.download(tickers=self.coins, period = "1d", interval = "15m"),
+            "5d": yf.download(tickers=self.coins, period = "5d", interval = "60m"),
+            "1y": yf.download(tickers=self.coins, period = "1y", interval = "1d"),
+            "prices": download_prices(self.coins),
+            "updated": datetime.now(),
+        }
+        self.save_snapshot(snapshot)
+        self._swap(snapshot)
+        for listener in self._listeners:
+            listener()
+
+    def _current(self):
+        """returns the snapshot, first swapping in the last one published to the shared cache"""
+        if self.shared is not None and time.time() - self._polled >= self.poll_seconds:
+            self._polled = time.time()
+            snapshot = self.shared.load()
+            if snapshot is not None and snapshot is not self.snapshot:
+                self._swap(snapshot)
+        return self.snapshot
+
+    def wait(self, timeout=None):
+        """blocks until data is available, returns False on timeout"""
+        if self.shared is None:
+            return self._loaded.wait(timeout)
+        deadline = None if timeout is None else time.time() + timeout
+        while self._current() is None:
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(min(self.poll_seconds, 0.5))
+            self._polled = 0
+        return True
+
+    def frame(self, lb_range="1y"):
+        """returns the frame of the range (1d, 5d, 1mo, 2mo, 3mo, 1y) or None before the first load"""
+        snapshot = self._current()
+        if snapshot is None:
+            return None
+        if lb_range in ["1mo", "2mo", "3mo"]:
+            months = int(lb_range[0])
+            data = snapshot["1y"]
+            return data.loc[data.index >= datetime.now() - relativedelta(months=months)]
+        return snapshot[lb_range]
+
+    @property
+    def prices(self):
+        snapshot = self._current()
+        return None if snapshot is None else snapshot["prices"]
+
+
+def download_prices(coins):
+    """returns the current binance price of each coin"""
+    leaderboard_prices = pd.DataFrame(columns = ["Price"])
+    for coin in coins:
+        if coin == "LUNA1-USD":
+            coin = "LUNA-USD"
+        key = "https://api.binance.com/api/v3/ticker/price?symbol="
+        coin_key = coin.replace("-", "")
+        coin_key = coin_key + "T"
+        url = key + coin_key
+        data = requests.get(url, timeout=10)
+        data = data.json()
+        rounded = np.round(float(data["price"]), 3)
+        leaderboard_prices.loc[coin] = rounded
+    return leaderboard_prices
@@ -0,0 +1,22 @@
+# ----------------------------------------------------------------------------------------------------------------------
+# Gunicorn configuration of the web dyno
+#
+# The master starts a single market data refresher (refresher.py) before forking the workers, the workers read the
+# frames and prices it publishes in shared memory (MARKET_DATA=shared, see shared_cache.py) instead of downloading
+# their own. The port and the number of workers come from heroku ($PORT, $WEB_CONCURRENCY).
+
+raw_env = ["MARKET_DATA=shared"]
+
+refresher = None
+
+
+def on_starting(server):
+    global refresher
+    from refresher import start
+
+    refresher = start()
+
+
+def on_exit(server):
+    if refresher is not None:
+        refresher.terminate()
@@ -0,0 +1,45 @@
+import multiprocessing
+import os
+import time
+
+from data_provider import COINS, MarketData
+from shared_cache import SharedSnapshot
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Market data refresher
+#
+# The one process of the dyno that downloads market data: it refreshes the snapshot every REFRESH_SECONDS and
+# publishes it to the shared cache the gunicorn workers read (shared_cache.py), so the requests to yahoo and binance
+# do not grow with the number of workers. The gunicorn master starts it (gunicorn.conf.py), it also runs on its own:
+#
+#   python refresher.py
+
+
+def run(refresh_seconds=None):
+    refresh_seconds = refresh_seconds or int(os.environ.get("REFRESH_SECONDS", 900))
+    shared = SharedSnapshot()
+    market_data = MarketData(COINS, directory="snapshot")
+    market_data.subscribe(lambda: shared.publish(market_data.snapshot))
+
+    # the snapshot left on disk is published right away, the workers serve it while the first download runs
+    market_data.load_snapshot()
+    if market_data.snapshot is not None:
+        shared.publish(market_data.snapshot)
+    while True:
+        try:
+            market_data.refresh()
+        except Exception as error:
+            print(f"refresher: refresh failed, the workers keep the last snapshot ({error})")
+        time.sleep(refresh_seconds)
+
+
+def start():
+    """starts the refresher in a new process, returns the process"""
+    # spawned rather than forked from the gunicorn master
+    process = multiprocessing.get_context("spawn").Process(target=run, name="market-data-refresher", daemon=True)
+    process.start()
+    return process
+
+
+if __name__ == '__main__':
+    run()
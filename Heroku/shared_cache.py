@@ -0,0 +1,110 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+
+import pandas as pd
+import pyarrow as pa
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Shared market data cache
+#
+# The gunicorn workers of the dyno read the leaderboard frames and prices from one copy in shared memory instead of
+# each downloading and keeping its own. A single refresher process (refresher.py, started by the gunicorn master, see
+# gunicorn.conf.py) writes every snapshot as Arrow IPC files into a new generation directory under /dev/shm and then
+# points the manifest at it. The workers memory map the files: the pages of the frames are shared by all of them, only
+# the pandas wrappers are per worker. NaN is written as a float value rather than a null, so the columns are read
+# without a copy.
+
+
+def default_directory():
+    """the cache directory in shared memory (the temp directory where there is no /dev/shm)"""
+    base = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return os.environ.get("SHARED_CACHE_DIR", os.path.join(base, "bc5-market-data"))
+
+
+def write_frame(df, path):
+    """writes df as an Arrow IPC file: the index, then one array per column, the labels in the schema metadata"""
+    arrays = [pa.array(df.index)]
+    for i in range(df.shape[1]):
+        values = df.iloc[:, i].to_numpy()
+        arrays.append(pa.array(values, from_pandas=values.dtype == object))
+    labels = {"index": df.index.name, "names": list(df.columns.names),
+              "columns": [list(column) if isinstance(column, tuple) else column for column in df.columns]}
+    table = pa.table(arrays, names=["index"] + [str(i) for i in range(df.shape[1])],
+                     metadata={"frame": json.dumps(labels)})
+    with pa.OSFile(path, "wb") as file, pa.ipc.new_file(file, table.schema) as writer:
+        writer.write_table(table)
+
+
+def read_frame(path):
+    """returns the frame of an Arrow IPC file written by write_frame, its columns are read only views of the mapping"""
+    table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+    labels = json.loads(table.schema.metadata[b"frame"])
+    # split_blocks keeps one block per column, pandas would otherwise copy them into one 2D block
+    df = table.select(table.column_names[1:]).to_pandas(split_blocks=True)
+    if len(labels["names"]) > 1:
+        df.columns = pd.MultiIndex.from_tuples([tuple(column) for column in labels["columns"]], names=labels["names"])
+    else:
+        df.columns = pd.Index(labels["columns"], name=labels["names"][0])
+    df.index = pd.Index(table.column("index").to_pandas(), name=labels["index"])
+    return df
+
+
+class SharedSnapshot:
+    """market data snapshots ({name: frame, ..., "updated": datetime}) published by one process, read by the others"""
+
+    def __init__(self, directory=None, keep=2):
+        self.directory = directory or default_directory()
+        # generations kept on disk, a reader may still be opening the files of the previous one
+        self.keep = keep
+        self._generation = None
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _manifest(self):
+        try:
+            with open(os.path.join(self.directory, "manifest.json")) as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def publish(self, snapshot):
+        """writes the snapshot as a new generation and makes it the current one"""
+        manifest = self._manifest()
+        generation = 1 if manifest is None else manifest["generation"] + 1
+        path = os.path.join(self.directory, str(generation))
+        os.makedirs(path, exist_ok=True)
+        frames = [name for name, value in snapshot.items() if isinstance(value, pd.DataFrame)]
+        for name in frames:
+            write_frame(snapshot[name], os.path.join(path, name + ".arrow"))
+
+        # readers see the new generation once the manifest is replaced, never a half written one
+        manifest = {"generation": generation, "frames": frames, "updated": snapshot["updated"].isoformat()}
+        tmp_path = os.path.join(self.directory, "manifest.json.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, os.path.join(self.directory, "manifest.json"))
+
+        for name in os.listdir(self.directory):
+            if name.isdigit() and int(name) <= generation - self.keep:
+                shutil.rmtree(os.path.join(self.directory, name), ignore_errors=True)
+
+    def load(self):
+        """returns the current snapshot, None if nothing was published yet; a generation is only read once"""
+        manifest = self._manifest()
+        with self._lock:
+            if manifest is None or manifest["generation"] == self._generation:
+                return self._snapshot
+            path = os.path.join(self.directory, str(manifest["generation"]))
+            try:
+                snapshot = {name: read_frame(os.path.join(path, name + ".arrow")) for name in manifest["frames"]}
+            except (OSError, pa.ArrowInvalid) as error:
+                print(f"shared cache: could not read generation {manifest['generation']} ({error})")
+                return self._snapshot
+            snapshot["updated"] = datetime.fromisoformat(manifest["updated"])
+            self._snapshot = snapshot
+            self._generation = manifest["generation"]
+            return snapshot